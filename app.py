@@ -4,31 +4,58 @@ from fasthtml.oauth import GoogleAppClient
 import asyncio
 from collections import deque
 from dataclasses import dataclass, field
-import concurrent.futures
 import logging
-import threading
+import math
+import time
 from typing import List, Tuple
-from auth import HuggingFaceClient
-from difflib import SequenceMatcher
-from js_scripts import ThemeSwitch, enterToGuess
+from auth import HuggingFaceClient, oauth_http
+from broadcast import element_id, prerender, render
+from bus import LeaderLock, create_bus
+from client_hub import ClientHub
+from event_log import EventLog, replay
+from leaderboard import Leaderboard
+from ledger import PointsLedger
+from word_deck import WordDeck
+from word_import import WORDS_INDEXES, import_words
+from player_store import PlayerRecord, PlayerStore
+from presence import ANONYMOUS, Presence
+from matcher import NearMissMatcher
+from rate_limit import RateLimiter, TokenBucket
+from rooms import RoomManager
+from scheduler import TickClock
+from js_scripts import ThemeSwitch, countdownTicker, enterToGuess, trimGuessFeed
 import env_vars
-import sqlite3
-from datasets import load_dataset
+import metrics
 from how_to_play import rules
 from faq import qa
 import random
 
 logging.basicConfig(level=logging.DEBUG)
 
+# the countdown turns red for the last seconds of a round
+COUNTDOWN_URGENT_SEC = 5
+
 SIGN_IN_TEXT = """Only logged users can play. Press on either "Sign in with HuggingFace" or "Sign in with Google"."""
 
 db_path = f'{env_vars.DB_DIRECTORY}guess.db'
-db = database(db_path)
+db = metrics.timed_queries(database(db_path))
 players = db.t.players
 words = db.t.words
-    
-def similar(a, b):
-    return SequenceMatcher(None, a, b).ratio()
+ledger = PointsLedger(db, players)
+event_log = EventLog()
+word_deck = WordDeck(db, words)
+player_store = PlayerStore(db, players, ledger)
+guess_limiter = RateLimiter(env_vars.GUESS_RATE_PER_SEC, env_vars.GUESS_BURST)
+buy_limiter = RateLimiter(env_vars.BUY_RATE_PER_SEC, env_vars.BUY_BURST)
+# shared by every room, so the feed budget holds for the whole server however many rooms are open
+feed_bucket = TokenBucket(env_vars.FEED_BROADCAST_RATE_PER_SEC, env_vars.FEED_BROADCAST_BURST)
+bus = create_bus()
+hub = ClientHub(bus)
+leader_lock = LeaderLock()
+worker_seen = {}
+WORKER_HEARTBEAT_SEC = 5
+LEADER_RETRY_SEC = 2
+
 
 
 css = [
@@ -47,6 +74,13 @@ css = [
     Style('.login { margin-bottom: 10px; max-width: fit-content; margin-left: auto; margin-right: auto;}'),
     Style('.primary:active { background-color: #0056b3; }'),
     Style('.last-tab  { display: flex; align-items: center;  justify-content: center;}'),
+    # classes of the fragments pushed over the websocket, so they carry no inline styles
+    Style('.countdown { text-align: center; font-size: 40px; } .countdown.urgent { color: red; }'),
+    Style('.hidden-word { font-size: 40px; letter-spacing: 10px; text-align: center; }'),
+    Style('.hints { border: 1px solid #ccc; height: 300px; padding: 10px; margin-top: 20px; display: flex; flex-direction: column; } .hints > div { font-size: 20px; flex: 1; }'),
+    Style('.guesses { height: 700px; overflow-y: auto; border: 1px solid #ccc; display: flex; flex-direction: column-reverse; } .guesses > div { border-bottom: 1px solid #ccc; padding: 5px; } .guesses > .correct { background-color: #77ab59; }'),
+    Style('.leaderboard h1, .leaderboard th:last-child { text-align: center; } .leaderboard td { padding: 5px; } .leaderboard td:first-child { width: 50px; text-align: center; } .leaderboard td:last-child { text-align: center; }'),
+    Style('.guess-form { border: 5px solid #eaf6f6; padding: 10px; width: 100%; margin: 10px auto; } .buy-form { padding: 10px; width: 50%; margin: 10px auto; } .guess-form button, .buy-form button { width: 100%; }'),
     Style('@media (max-width: 768px) { .side-panel { display: none; } .middle-panel { display: block; flex: 1; } .trivia-question { font-size: 20px; } #login-badge { width: 70%; } .login { display: flex; justify-content: center; align-items: center; height: 100%; } .login a {display: flex; justify-content: center; align-items: center; } #google { display: flex; justify-content: center; align-items: center; }}'),
     Style('@media (min-width: 769px) { .login_wrapper { display: none; } .bid_wrapper {display: none; } .past_topic_wrapper {display: none;} .trivia-question { font-size: 30px; }}'),
     Style('@media (max-width: 446px) { #how-to-play { font-size: 12px; height: 49.6px; white-space: normal; word-wrap: break-word; display: inline-flex; justify-content: center; align-items: center} #stats { height: 49.6px; } }'),
@@ -59,12 +93,16 @@ huggingface_client = HuggingFaceClient(
     client_secret=env_vars.HF_CLIENT_SECRET,
     redirect_uri=env_vars.HF_REDIRECT_URI
 )
+huggingface_client.token_url = env_vars.HF_TOKEN_URL
+huggingface_client.info_url = env_vars.HF_INFO_URL
 
 GoogleClient = GoogleAppClient(
     client_id=env_vars.GOOGLE_CLIENT_ID,
     redirect_uri=env_vars.GOOGLE_REDIRECT_URI,
     client_secret=env_vars.GOOGLE_CLIENT_SECRET
 )
+GoogleClient.token_url = env_vars.GOOGLE_TOKEN_URL
+GoogleClient.info_url = env_vars.GOOGLE_INFO_URL
 
 @dataclass
 class Word:
@@ -76,55 +114,226 @@ class Word:
     hint5: str
 
 
+@dataclass
+class Round:
+    word_id: int
+    word: Word
+    random_letters: List[int]
+    buyable_mask: int
+    matcher: NearMissMatcher
+    reset_fragment: object
+    timeline: List[Tuple[int, str, object]]
+
+
+def reveal_timeline(word, random_letters, countdown: int = env_vars.WORD_COUNTDOWN_SEC):
+    """Everything that changes on screen during a round, worked out when the round is prepared: a list of
+    (countdown value it happens at, kind, payload) in the order it happens. Kinds are 'hints' (the prerendered
+    hints panel), 'letter' (a position revealed to everyone) and 'countdown_style'."""
+    hints = {"Hint 1": word.hint1, "Hint 2": "", "Hint 3": ""}
+    timeline = [(countdown, 'hints', prerender(hints_div(hints)))]
+    hints["Hint 2"] = word.hint2
+    timeline.append((int(countdown / 3 * 2), 'hints', prerender(hints_div(hints))))
+    hints["Hint 3"] = word.hint3
+    timeline.append((int(countdown / 3), 'hints', prerender(hints_div(hints))))
+    timeline.append((int(countdown / 4 * 3), 'letter', random_letters[0]))
+    timeline.append((int(countdown / 4 * 2), 'letter', random_letters[1]))
+    timeline.append((COUNTDOWN_URGENT_SEC, 'countdown_style', "countdown urgent"))
+    # stable, so events due at the same second keep the order above
+    return sorted(timeline, key=lambda event: -event[0])
+
+
+def load_leaderboard(limit):
+    ledger.flush()
+    return db.q(f"select {players.c.id}, {players.c.name}, {players.c.points} from {players} order by {players.c.points} desc limit ?", (limit,))
+
+
+leaderboard = Leaderboard(load=load_leaderboard)
+_leaderboard_div = (None, None)
+
+
+def current_leaderboard_div():
+    # rendered once per leaderboard version and shared by every room
+    global _leaderboard_div
+    version, top = leaderboard.snapshot()
+    if _leaderboard_div[0] != version:
+        _leaderboard_div = (version, leaderboard_div(top))
+    return _leaderboard_div
+
+
+def leaderboard_div(top):
+    cells = [Tr(Td(f"{idx}."), Td(name), Td(points)) for idx, (name, points) in enumerate(top, start=1)]
+
+    leaderboard = Div(
+        Div(H1("Leaderboard"), Table(Tr(Th(B("Rank")), Th(B('Username')), Th(B("Points"))), *cells))
+    )
+    return Div(leaderboard, id='leaderboard', cls='leaderboard')
+
+
+def login_points_div(player):
+    return Div(player.name + ": " + str(player.points) + " pts", cls='login', id='login_points')
+
+
+def current_word_div(word):
+    current_word_info = Div(
+        Div(
+            Div(word.word),
+            cls="card"),
+    )
+    return Div(current_word_info, id="current_word_info")
+
+
+def guesses_div(guesses):
+    guesses_html = [guess_row(elem) for elem in guesses[::-1]]
+    return Div(*guesses_html, id='guesses', cls='guesses')
+
+
+def hints_div(hints):
+    return Div((Div(f"{hint}: {hints[hint]}") for hint in hints), id='hints', cls='hints')
+
+
+def masked_word(word, mask):
+    "`word` with the letters whose bit is not set in `mask` replaced by underscores"
+    return ''.join(letter if mask >> i & 1 else "_" for i, letter in enumerate(word))
+
+
+def mask_positions(mask):
+    return [i for i in range(mask.bit_length()) if mask >> i & 1]
+
+
+def hidden_word_div(word_to_show):
+    return Div(word_to_show, id='hidden_word', cls='hidden-word')
+
+
+def guess_row(elem):
+    return Div(
+        f"{elem['user_id']}: {elem['guess']}",
+        cls='correct' if elem['guess'] == 'answered correctly' else None
+    )
+
+
 class TaskManager:
-    def __init__(self, num_executors: int):
-        self.executors = [concurrent.futures.ThreadPoolExecutor(max_workers=1) for _ in range(num_executors)]
-        self.executor_tasks = [set() for _ in range(num_executors)]
-        self.current_word_start_time = None
-        self.current_timeout_task = None
-        self.online_users = {"unassigned_clients": {'ws_clients': set(), 'combo_count': 0, 'letters_shown': [], 'available_letters': [] }}  # Track connected WebSocket clients
-        self.online_users_lock = threading.Lock()
+    def __init__(self, room_id: str, recovered=None):
+        self.room_id = room_id
+        # state of the round this room was playing when the previous game server stopped, from the event log
+        self.recovered = recovered
+        self.restored_masks = {}
+        self.clock = TickClock()
+        # connection ids of the websockets in this room, on every worker, by user
+        self.online_users = Presence(new_user=self.new_user)
         self.task = None
         self.countdown_var = env_vars.WORD_COUNTDOWN_SEC
-        self.all_users = {}
-        self.guesses = []
-        self.guesses_lock = asyncio.Lock()
+        self.guesses = deque(maxlen=env_vars.GUESSES_FEED_SIZE)
+        # guesses are judged one at a time by consume_guesses; what a batch of them changed is pushed in one go
+        self.guess_queue = asyncio.Queue()
+        self.guess_task = None
+        self.batch_window = env_vars.GUESS_BATCH_MS / 1000
+        self.new_guesses = []
+        self.new_points = {}
+        self.feed_behind = False
         self.current_word = None
-        self.hints = {"Hint 1": "", "Hint 2": "", "Hint 3": ""}
+        self.hints_fragment = None
+        self.timeline = []
+        self.timeline_pos = 0
+        self.countdown_style = "countdown"
+        self.round_deadline = None
         self.current_winners = []
-        self.current_winners_lock = asyncio.Lock()
         self.random_letters = None
-        self.current_letters = []
+        self.public_mask = 0
+        self.buyable_mask = 0
+        self.matcher = None
+        self.next_round_task = None
+        self.leaderboard_version = None
 
     def reset(self):
         self.countdown_var = env_vars.WORD_COUNTDOWN_SEC
 
-    async def run_executor(self, executor_id: int):
-        while True:
-            await self.update_status()
-            await asyncio.sleep(0.1)
+    def start(self):
+        self.task = asyncio.create_task(self.run_rounds())
+        self.guess_task = asyncio.create_task(self.consume_guesses())
 
-    async def update_status(self):
-        await asyncio.sleep(1)
-        should_consume = False
-        if self.current_word is None:
-            should_consume = True
-        if should_consume:
-            if self.task:
-                self.task.cancel()
-            self.reset()
-            self.task = asyncio.create_task(self.count())
-            async with self.guesses_lock:
-                self.guesses = []
-            async with self.current_winners_lock:
-                self.current_winners = []
-            await self.broadcast_guesses()
-            await self.consume_successful_word()
-        
+    def stop(self):
+        for task in [self.task, self.guess_task, self.next_round_task]:
+            if task:
+                task.cancel()
 
-    async def consume_successful_word(self):
-        word = None
-        query = db.q(f"SELECT * FROM {words} WHERE LENGTH(word) > 5 ORDER BY RANDOM() LIMIT 1")[0]
+    async def run_rounds(self):
+        """The room's only clock: starts a round, ticks once a second until the countdown reaches 0 and starts the
+        next one. Ticks are scheduled against the round start, so a slow tick or rollover does not shift the rest."""
+        loop = asyncio.get_running_loop()
+        round_start = loop.time()
+        while True:
+            first_tick = 0
+            try:
+                if self.recovered:
+                    elapsed = await self.resume_round()
+                    round_start = loop.time() - elapsed
+                    first_tick = math.ceil(elapsed)
+                else:
+                    await self.rollover()
+                    # a rollover that overran the first tick starts the round late instead of cutting it short
+                    if loop.time() - round_start > self.clock.interval:
+                        round_start = loop.time()
+            except Exception:
+                # e.g. the bus or the words table is briefly unavailable: try a fresh rollover rather than stop the room
+                logging.exception(f"Could not start the next round of room {self.room_id}")
+                await asyncio.sleep(self.clock.interval)
+                round_start = loop.time()
+                continue
+            self.clock.start(round_start, first_tick)
+            self.round_deadline = self.clock.deadline(env_vars.WORD_COUNTDOWN_SEC)
+            tick = -1
+            while tick < env_vars.WORD_COUNTDOWN_SEC:
+                tick = min(await self.clock.next_tick(), env_vars.WORD_COUNTDOWN_SEC)
+                self.countdown_var = env_vars.WORD_COUNTDOWN_SEC - tick
+                try:
+                    await self.tick()
+                except Exception:
+                    # one failed push must not stop the room's clock; the next tick tries again
+                    logging.exception(f"Tick {tick} of room {self.room_id} failed")
+            round_start = self.clock.deadline(env_vars.WORD_COUNTDOWN_SEC)
+            logging.debug(f"Completing word: {self.current_word.word}")
+
+    async def tick(self):
+        await self.play_timeline()
+        await self.broadcast_countdown()
+        await self.broadcast_letters()
+        await self.broadcast_leaderboard()
+        await self.catch_up_guesses()
+
+    async def rollover(self):
+        prepared = await self.take_prepared_round()
+        self.reset()
+        self.guesses.clear()
+        self.new_guesses = []
+        self.feed_behind = False
+        self.current_winners = []
+        await self.consume_successful_word(prepared)
+        event_log.append({'t': 'round', 'room': self.room_id, 'word_id': prepared.word_id, 'random_letters': prepared.random_letters})
+
+    async def resume_round(self):
+        "Pick the recovered round back up where it was; returns how many seconds of it had already run"
+        recovered, self.recovered = self.recovered, None
+        query = word_deck.get(recovered['word_id'])
+        if query is None:
+            await self.rollover()
+            return 0
+        prepared = self.prepare_round(query, recovered['random_letters'])
+        elapsed = min(max(time.time() - recovered['started'], 0.0), env_vars.WORD_COUNTDOWN_SEC)
+        self.countdown_var = env_vars.WORD_COUNTDOWN_SEC - int(elapsed)
+        self.guesses.clear()
+        self.guesses.extend(recovered['guesses'])
+        self.new_guesses = []
+        # the reset fragment empties the feed; the first tick sends the recovered one
+        self.feed_behind = True
+        self.current_winners = list(recovered['winners'])
+        await self.consume_successful_word(prepared)
+        # letters bought before the restart, given back when their owners reconnect
+        self.restored_masks = dict(recovered['letters'])
+        logging.info(f"Room {self.room_id} resumed its round {elapsed:.1f}s in")
+        return elapsed
+
+    def prepare_round(self, query=None, random_letters=None):
+        query = query or word_deck.draw()
         word = Word(
             word=query['word'].upper(),
             hint1=query['hint1'],
@@ -133,190 +342,357 @@ class TaskManager:
             hint4=query['hint4'],
             hint5=query['hint5'],
         )
+        random_letters = random_letters or random.sample(range(0, len(word.word)), 2)
+        reset_fragment = prerender(
+            guesses_div([]),
+            hidden_word_div("_" * len(word.word)),
+            hints_div({"Hint 1": "", "Hint 2": "", "Hint 3": ""}),
+            Div(guess_form(self.room_id), id='guess_form'),
+            current_word_div(word),
+        )
+        return Round(
+            word_id=query['id'],
+            word=word,
+            random_letters=random_letters,
+            # letters that are revealed to everyone later in the round cannot be bought
+            buyable_mask=sum(1 << i for i in range(len(word.word)) if i not in random_letters),
+            matcher=NearMissMatcher(word.word),
+            reset_fragment=reset_fragment,
+            timeline=reveal_timeline(word, random_letters),
+        )
+
+    async def prefetch_round(self, delay: float = 0):
+        # runs while the current round is counting down, away from the rollover itself
+        await asyncio.sleep(delay)
+        return self.prepare_round()
+
+    async def take_prepared_round(self):
+        # cleared first, so a prefetch that failed is not awaited again by the next rollover
+        prepared_task, self.next_round_task = self.next_round_task, None
+        if prepared_task is None:
+            prepared_task = asyncio.create_task(self.prefetch_round())
+        prepared = await prepared_task
+        self.next_round_task = asyncio.create_task(self.prefetch_round(delay=1))
+        return prepared
+
+    async def consume_successful_word(self, prepared):
+        word = prepared.word
         self.current_word = word
-        self.hints = {"Hint 1": "", "Hint 2": "", "Hint 3": ""}
-        self.random_letters = random.sample(range(0, len(self.current_word.word)), 2)
-        self.current_letters = []
-        with self.online_users_lock:
-            for client_key in self.online_users:
-                self.online_users[client_key]['letters_shown'] = []
-                self.online_users[client_key]['available_letters'] = [i for i in range(len(self.current_word.word)) if i not in self.random_letters]
-        self.current_word_start_time = asyncio.get_event_loop().time()
-        self.current_timeout_task = asyncio.create_task(self.word_timeout())
-        if word:
-            logging.debug(f"We have a word to broadcast: {word.word}")
-            await self.broadcast_current_word()
-            await self.send_to_clients(Div(guess_form(), id='guess_form'))
-            logging.debug(f"Word consumed: {word.word}")
+        self.hints_fragment = None
+        self.timeline = prepared.timeline
+        self.timeline_pos = 0
+        self.countdown_style = "countdown"
+        self.random_letters = prepared.random_letters
+        self.matcher = prepared.matcher
+        self.public_mask = 0
+        self.buyable_mask = prepared.buyable_mask
+        self.restored_masks = {}
+        for _, data in self.online_users.snapshot():
+            # the reset fragment below shows everyone a fully hidden word
+            data['letters_mask'] = 0
+            data['sent_mask'] = 0
+        logging.debug(f"We have a word to broadcast: {word.word}")
+        await self.send_to_clients(prepared.reset_fragment)
+        logging.debug(f"Word consumed: {word.word}")
         return word
 
-    async def word_timeout(self):
+    def new_user(self, client_key):
+        # letters_mask: bit i set when letter i is shown to that user; sent_mask: the mask their hidden word was last sent with
+        letters_mask = self.public_mask | self.restored_masks.pop(client_key, 0)
+        return {'combo_count': 0, 'letters_mask': letters_mask, 'sent_mask': None}
+
+    def add_client(self, client_key, client):
+        self.online_users.add(client_key, client)
+
+    def remove_client(self, client):
+        removed = self.online_users.remove(client)
+        if removed is None:
+            return
+        client_key, gone = removed
+        logging.debug("Removed disconnected client: %s", client)
+        if gone and gone['letters_mask'] & ~self.public_mask:
+            # letters bought this round come back if the user reconnects before it ends
+            self.restored_masks[client_key] = gone['letters_mask']
+
+    def remove_worker_clients(self, worker_id):
+        "Forget the connections of a worker that stopped sending heartbeats"
+        prefix = f"{worker_id}:"
+        for client in [client for client in self.online_users.sockets() if client.startswith(prefix)]:
+            self.remove_client(client)
+
+    async def send_to_clients(self, element, coalesce=True, users=None):
+        # rendered once here; every worker queues the html for its own websockets of this room
+        fragment = prerender(element)
+        await bus.publish('fanout', {'room': self.room_id, 'key': fragment.key, 'html': fragment.html, 'coalesce': coalesce, 'users': users})
+
+    async def send_to_user(self, element, client_key):
+        if client_key in self.online_users:
+            await self.send_to_clients(element, users=[client_key])
+
+    def initial_fragments(self, client_key):
+        "What a websocket that just connected to this room is sent, as `[key, html]` pairs"
+        elements = []
+        player = player_store.get(client_key) if client_key != ANONYMOUS else None
+        if player:
+            elements.append(login_points_div(player))
+        if self.current_word:
+            elements.append(current_word_div(self.current_word))
+            if self.round_deadline is not None:
+                elements.append(self.countdown_div())
+            # other tabs of this user may already have the current mask, so it is not resent on the next tick
+            elements.append(hidden_word_div(masked_word(self.current_word.word, self.online_users[client_key]['letters_mask'])))
+        if self.hints_fragment:
+            # hints are only sent when they change
+            elements.append(self.hints_fragment)
+        elements.append(guesses_div(list(self.guesses)))
+        elements.append(current_leaderboard_div()[1])
+        elements.append(Div(guess_form(self.room_id), id='guess_form'))
+        elements.append(Div(buy_form(self.room_id), id='buy_form'))
+        return [[element_id(element), render(element)] for element in elements]
+
+    def countdown_div(self):
+        countdown_format = self.countdown_var if self.countdown_var >= 10 else f"0{self.countdown_var}"
+        if env_vars.COUNTDOWN_MODE != 'client':
+            return Div(f"{countdown_format}", cls=self.countdown_style, id="countdown")
+        # time left rather than a wall-clock deadline, so the browser's clock does not have to agree with ours
+        remaining = self.countdown_var if self.round_deadline is None else max(0.0, self.round_deadline - asyncio.get_running_loop().time())
+        return Div(f"{countdown_format}", cls=self.countdown_style, id="countdown",
+                   data_remaining_ms=int(remaining * 1000), data_urgent_at=COUNTDOWN_URGENT_SEC)
+
+    async def broadcast_countdown(self):
+        # in client mode the browser ticks the countdown itself; we only send it when the round starts and to resync
+        elapsed = env_vars.WORD_COUNTDOWN_SEC - self.countdown_var
+        if env_vars.COUNTDOWN_MODE == 'client' and elapsed % env_vars.COUNTDOWN_RESYNC_SEC != 0:
+            return
+        await self.send_to_clients(self.countdown_div())
+
+    async def broadcast_guesses(self):
+        await self.send_to_clients(guesses_div(list(self.guesses)))
+
+    async def queue_guess(self, payload):
+        "Hand a guess to the room's consumer and wait for the reply to the player"
+        reply = asyncio.get_running_loop().create_future()
+        self.guess_queue.put_nowait((payload, reply))
+        # a bus call answered by this same worker has no timeout of its own
+        return await asyncio.wait_for(reply, env_vars.BUS_CALL_TIMEOUT_SEC)
+
+    async def consume_guesses(self):
+        """The only place guesses are judged, in the order they arrived. Each one is answered as soon as it is
+        judged; the feed rows and points changes of everything that arrives within `batch_window` of the first
+        guess of a batch are pushed once, at the end of the batch."""
+        loop = asyncio.get_running_loop()
+        getter = asyncio.ensure_future(self.guess_queue.get())
         try:
-            await asyncio.sleep(env_vars.WORD_COUNTDOWN_SEC)
-            logging.debug(f"{env_vars.WORD_COUNTDOWN_SEC} seconds timeout completed")
-            await self.check_word_completion()
-        except asyncio.CancelledError:
-            logging.debug("Timeout task cancelled")
-            pass
-
-    async def check_word_completion(self):
-        should_consume = False
-        current_time = asyncio.get_event_loop().time()
-        logging.debug(current_time)
-        logging.debug(self.current_word_start_time)
-        if self.current_word and (current_time - self.current_word_start_time >= env_vars.WORD_COUNTDOWN_SEC - 1):
-            logging.debug(f"Completing word: {self.current_word.word}")
-            should_consume = True
-        if should_consume:
-            if self.task:
-                self.task.cancel()
-                self.reset()
-            self.task = asyncio.create_task(self.count())
-            async with self.guesses_lock:
-                self.guesses = []
-            async with self.current_winners_lock:
-                self.current_winners = []
+            while True:
+                await asyncio.wait({getter})
+                batch_end = loop.time() + self.batch_window
+                while getter.done():
+                    self.answer_guess(*getter.result())
+                    getter = asyncio.ensure_future(self.guess_queue.get())
+                    # a get that is still pending when the window closes starts the next batch
+                    await asyncio.wait({getter}, timeout=max(0.0, batch_end - loop.time()))
+                try:
+                    await self.push_guess_batch()
+                except Exception:
+                    # the batch is lost for the clients (the next tick catches the feed up), the consumer is not
+                    self.feed_behind = True
+                    logging.exception(f"Could not push the guesses of room {self.room_id}")
+        finally:
+            getter.cancel()
+
+    def answer_guess(self, payload, reply):
+        if reply.done():
+            # the player already got a timeout, so the guess is not played
+            return
+        try:
+            result = judge_guess(self, payload)
+        except Exception as e:
+            if not reply.done():
+                reply.set_exception(e)
+            return
+        if not reply.done():
+            reply.set_result(result)
+
+    def add_guess(self, guess_dict):
+        "Record a guess in the feed; the clients get it with the rest of its batch"
+        self.guesses.append(guess_dict)
+        self.new_guesses.append(guess_dict)
+        event_log.append({'t': 'guess', 'room': self.room_id, 'entry': guess_dict})
+
+    async def push_guess_batch(self):
+        rows, self.new_guesses = self.new_guesses, []
+        winners, self.new_points = self.new_points, {}
+        if rows:
+            if self.feed_behind or not feed_bucket.take():
+                # over the global feed budget: the next tick resends the whole feed once instead
+                self.feed_behind = True
+            else:
+                # the feed is rendered newest first, so the new rows go in front of the existing ones, newest first
+                await self.send_to_clients(Div(*[guess_row(row) for row in reversed(rows)], id='guesses', hx_swap_oob='afterbegin'), coalesce=False)
+        for player in winners.values():
+            await self.send_to_user(login_points_div(player), player.name)
+        if winners:
+            await self.broadcast_leaderboard()
+
+    async def catch_up_guesses(self):
+        if self.feed_behind:
+            self.feed_behind = False
             await self.broadcast_guesses()
-            await self.consume_successful_word()
 
-    async def send_to_clients(self, element, client=None):
-        with self.online_users_lock:
-            clients = (self.online_users if client is None else {'unknown': { 'ws_clients': [client]}}).copy()
-        for client in [item for subset in clients.values() for item in subset['ws_clients']]:
-            try:
-                await client(element)
-            except:
-                with self.online_users_lock:
-                    key_to_remove = None
-                    for key, clients_data in self.online_users.items():
-                        if client in clients_data['ws_clients']:
-                            clients_data['ws_clients'].remove(client)
-                            if len(clients_data['ws_clients']) == 0:
-                                key_to_remove = key
-                            logging.debug(f"Removed disconnected client: {client}")
-                            break
-                    if key_to_remove:
-                        self.online_users.pop(key_to_remove)
-
-    async def broadcast_current_word(self, client=None):
-        current_word_info = Div(
-            Div(
-                Div(self.current_word.word),
-                cls="card"),
-        )
-        await self.send_to_clients(Div(current_word_info, id="current_word_info"), client)
-
-    async def count(self):
-        self.countdown_var = env_vars.WORD_COUNTDOWN_SEC
-        while self.countdown_var >= 0:
-            await self.broadcast_countdown()
-            await self.broadcast_hints()
-            await self.broadcast_letters()
-            await asyncio.sleep(1)
-            self.countdown_var -= 1
-
-    async def broadcast_countdown(self, client=None):
-        countdown_format = self.countdown_var if self.countdown_var >= 10 else f"0{self.countdown_var}"
-        style = "color: red;" if self.countdown_var <= 5 else ""
-        countdown_div = Div(f"{countdown_format}", cls="countdown", style="text-align: center; font-size: 40px;" + style, id="countdown")
-        await self.send_to_clients(countdown_div, client)
-
-    async def broadcast_guesses(self, client=None):
-        guesses = list(self.guesses)
-        guesses_html = [Div(
-            f"{elem['user_id']}: {elem['guess']}",
-            style=f"border-bottom: 1px solid #ccc; padding: 5px; background-color: {'#77ab59;' if elem['guess'] == 'answered correctly' else ''}"
-        ) for elem in guesses[::-1]]
-        await self.send_to_clients(Div(*guesses_html, id='guesses', style='height: 700px; overflow-y: auto; border: 1px solid #ccc; display: flex; flex-direction: column-reverse;'),client)
-
-    async def broadcast_leaderboard(self, client=None):
-        db_player = db.q(f"select * from {players} order by points desc limit 20")
-        cells = [Tr(Td(f"{idx}.", style="padding: 5px; width: 50px; text-align: center;"), Td(row['name'], style="padding: 5px;"), Td(row['points'], style="padding: 5px; text-align: center;")) for idx, row in enumerate(db_player, start=1)]
-            
-        leaderboard = Div(
-            Div(H1("Leaderboard", style="text-align: center;"), Table(Tr(Th(B("Rank")), Th(B('Username')), Th(B("Points"), style="text-align: center;")), *cells))
-        )
-        await self.send_to_clients(Div(leaderboard, id='leaderboard'), client)
-
-    async def broadcast_hints(self, client=None):
-        first = env_vars.WORD_COUNTDOWN_SEC / 3 * 2
-        second = env_vars.WORD_COUNTDOWN_SEC / 3
-        if self.current_word:
-            if self.countdown_var >= first and self.current_word.hint1 not in self.hints:
-                self.hints["Hint 1"] = self.current_word.hint1
-            if second <= self.countdown_var <= first and self.current_word.hint2 not in self.hints:
-                self.hints["Hint 2"] = self.current_word.hint2
-            if self.countdown_var <= second and self.current_word.hint3 not in self.hints:
-                self.hints["Hint 3"] = self.current_word.hint3
-        await self.send_to_clients(Div((Div(f"{hint}: {self.hints[hint]}", style='font-size: 20px; flex: 1;') for hint in self.hints), id='hints', style='border: 1px solid #ccc; height: 300px; padding: 10px; margin-top: 20px; display: flex; flex-direction: column;'))
-    
-    async def broadcast_letters(self, client=None):
-        first = int(env_vars.WORD_COUNTDOWN_SEC / 4 * 3)
-        second = int(env_vars.WORD_COUNTDOWN_SEC / 4 * 2)
-        if self.current_word and self.countdown_var in [first, second]:
-            idx = [first, second].index(self.countdown_var)
-            self.current_letters.append(self.random_letters[idx])
-            with self.online_users_lock:
-                for client_key in self.online_users:
-                    self.online_users[client_key]['letters_shown'].append(self.random_letters[idx])
-        for client_key in [key for key in self.online_users]:
-            word_to_show = ''.join(self.current_word.word[i] if i in self.online_users[client_key]['letters_shown'] else "_" for i in range(len(self.current_word.word)))
-            for client in self.online_users[client_key]['ws_clients']:
-                await self.send_to_clients(Div(word_to_show, id='hidden_word', style='font-size: 40px; letter-spacing: 10px; text-align: center;'), client)
+    async def broadcast_leaderboard(self):
+        # called once per tick; only pushes when the top of the board actually changed
+        version, div = current_leaderboard_div()
+        if version == self.leaderboard_version:
+            return
+        self.leaderboard_version = version
+        await self.send_to_clients(div)
+
+    async def play_timeline(self):
+        "Apply the events of the round's timeline that are due by the current countdown, each one exactly once"
+        while self.timeline_pos < len(self.timeline) and self.timeline[self.timeline_pos][0] >= self.countdown_var:
+            _, kind, payload = self.timeline[self.timeline_pos]
+            self.timeline_pos += 1
+            if kind == 'hints':
+                self.hints_fragment = payload
+                await self.send_to_clients(payload)
+            elif kind == 'letter':
+                self.public_mask |= 1 << payload
+            elif kind == 'countdown_style':
+                self.countdown_style = payload
+
+    async def broadcast_letters(self):
+        if self.current_word is None:
+            return
+        # users whose mask changed since their last update, grouped so each distinct hidden word is rendered once
+        groups = {}
+        for client_key, data in self.online_users.snapshot():
+            data['letters_mask'] |= self.public_mask
+            if data['letters_mask'] != data['sent_mask']:
+                groups.setdefault(data['letters_mask'], []).append((client_key, data))
+        for mask, users in groups.items():
+            await self.send_to_clients(hidden_word_div(masked_word(self.current_word.word, mask)), users=[client_key for client_key, _ in users])
+            # only marked as sent once published, so a failed push is retried on the next tick
+            for _, data in users:
+                data['sent_mask'] = mask
 
 
 def ensure_db_tables():
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute(f"PRAGMA synchronous={env_vars.SQLITE_SYNCHRONOUS}")
     if players not in db.t:
         players.create(id=int, name=str, points=int, pk='id')
+    # player_store looks players up by session id (their name)
+    db.execute(f"CREATE INDEX IF NOT EXISTS players_name ON {players} (name)")
 
     if words not in db.t:
-        # bulk import from HF dataset
-        dataset = load_dataset("Mihaiii/guess_the_word-3", split='train')
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE words (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                word TEXT NOT NULL,
-                hint1 TEXT NOT NULL,
-                hint2 TEXT NOT NULL,
-                hint3 TEXT NOT NULL,
-                hint4 TEXT NOT NULL,
-                hint5 TEXT NOT NULL
-            );
-        ''')
-        conn.commit()
-        insert_query = "INSERT INTO words (word, hint1, hint2, hint3, hint4, hint5) VALUES (?, ?, ?, ?, ?, ?)"
-        conn.execute('BEGIN TRANSACTION')
-        for record in dataset:
-            cursor.execute(insert_query, (
-                record['word'], record['hint #1'], record['hint #2'], record['hint #3'], record['hint #4'],
-                record['hint #5']))
-        conn.commit()
-        conn.close()
-        logging.debug("Count word rows:" + str(len(list(words.rows))))
-    
-async def app_startup():
+        import_words(db_path)
+        logging.debug("Count word rows:" + str(words.count))
+    for statement in WORDS_INDEXES:
+        db.execute(statement)
+
+
+def recover_from_event_log():
+    "Put back the balances logged by the previous game server and return the rounds it was running, by room id"
+    points, rounds = replay(event_log.read(), env_vars.WORD_COUNTDOWN_SEC)
+    for player_id, balance in points.items():
+        ledger.set(player_id, balance)
+    ledger.flush()
+    if points or rounds:
+        logging.info(f"Recovered {len(points)} player balances and {len(rounds)} running rounds from the event log")
+    return rounds
+
+
+async def become_leader():
+    logging.info(f"Worker {bus.worker_id} is running the game")
     ensure_db_tables()
+    word_deck.build()
     print()
-    num_executors = 2  # Change this to run more executors
-    task_manager = TaskManager(num_executors)
-    app.state.task_manager = task_manager
-    results = db.q(f"SELECT {players.c.name}, {players.c.id} FROM {players}")
-    task_manager.all_users = {row['name']: row['id'] for row in results}
-    for i in range(num_executors):
-        asyncio.create_task(task_manager.run_executor(i))
+    recovered_rounds = recover_from_event_log()
+    leaderboard.seed()
+    app.state.rooms = RoomManager(create_room=lambda room_id: TaskManager(room_id, recovered_rounds.pop(room_id, None)))
+    for room_id in list(recovered_rounds):
+        if RoomManager.valid_id(room_id):
+            app.state.rooms.open(room_id)
+    asyncio.create_task(app.state.rooms.run())
+    # segments are kept until every round they could resume is over
+    asyncio.create_task(event_log.run(db_path, keep_sec=2 * env_vars.WORD_COUNTDOWN_SEC))
+    if env_vars.POINTS_FLUSH_SEC > 0:
+        asyncio.create_task(ledger.run())
+    if bus.shared:
+        bus.subscribe('heartbeat', on_heartbeat)
+        asyncio.create_task(forget_silent_workers())
+    bus.serve({
+        'enter': enter_game,
+        'connect': connect_client,
+        'disconnect': disconnect_client,
+        'guess': place_guess,
+        'buy': buy_letter,
+    })
+    await bus.publish('leader', {'worker': bus.worker_id})
+
+
+async def wait_for_leadership():
+    while not leader_lock.acquire():
+        await asyncio.sleep(LEADER_RETRY_SEC)
+    await become_leader()
+
+
+async def on_leader_changed(message):
+    # the sockets of this worker were registered with the previous leader; htmx reconnects them to the new one
+    await hub.close_all()
+
+
+async def send_heartbeats():
+    while True:
+        await bus.publish('heartbeat', {'worker': bus.worker_id})
+        await asyncio.sleep(WORKER_HEARTBEAT_SEC)
+
+
+async def on_heartbeat(message):
+    worker_seen[message['worker']] = time.monotonic()
+
+
+async def forget_silent_workers():
+    while True:
+        await asyncio.sleep(WORKER_HEARTBEAT_SEC)
+        now = time.monotonic()
+        for worker_id, seen in list(worker_seen.items()):
+            if now - seen > 3 * WORKER_HEARTBEAT_SEC:
+                logging.info(f"Worker {worker_id} stopped sending heartbeats, dropping its clients")
+                del worker_seen[worker_id]
+                for task_manager in list(app.state.rooms.rooms.values()):
+                    task_manager.remove_worker_clients(worker_id)
 
 
-app = FastHTML(hdrs=(css, ThemeSwitch()), ws_hdr=True, on_startup=[app_startup])
+async def app_startup():
+    bus.subscribe('fanout', hub.deliver)
+    bus.subscribe('leader', on_leader_changed)
+    asyncio.create_task(bus.run())
+    if not bus.shared:
+        await become_leader()
+        return
+    asyncio.create_task(send_heartbeats())
+    if leader_lock.acquire():
+        await become_leader()
+    else:
+        asyncio.create_task(wait_for_leadership())
+
+
+async def app_shutdown():
+    await event_log.close()
+    ledger.flush()
+    await oauth_http.aclose()
+
+
+app = FastHTML(hdrs=(css, ThemeSwitch()), ws_hdr=True, on_startup=[app_startup], on_shutdown=[app_shutdown])
 rt = app.route
 setup_toasts(app)
 
 
 @rt("/auth/callback")
-def get(app, session, code: str = None):
+async def get(app, session, code: str = None):
     try:
-        user_info = huggingface_client.retr_info(code)
+        user_info = await huggingface_client.retr_info_async(code)
     except Exception as e:
         error_message = str(e)
         return f"An error occurred: {error_message}"
@@ -330,12 +706,16 @@ def get(app, session, code: str = None):
 
 
 @rt("/google/auth/callback")
-def get(app, session, code: str = None):
+async def get(app, session, code: str = None):
     if not code:
         add_toast(session, "Authentication failed", "error")
         return RedirectResponse(url="/")
-    GoogleClient.parse_response(code)
-    user_info = GoogleClient.get_info()
+    try:
+        user_info = await GoogleClient.retr_info_async(code)
+    except Exception as e:
+        logging.warning(f"Google sign in failed: {e!r}")
+        add_toast(session, "Authentication failed", "error")
+        return RedirectResponse(url="/")
     user_id = user_info.get('name')
     sub = str(user_info.get(GoogleClient.id_key))
     if 'session_id' not in session:
@@ -359,31 +739,25 @@ tabs = Nav(
 
 @rt('/')
 async def get(session, app, request):
-    task_manager = app.state.task_manager
+    return await game_page(session)
 
-    user_id = None
-    
-    if 'session_id' in session:
-        user_id = session['session_id']
-        
-        if user_id not in task_manager.all_users:
-            task_manager.all_users[user_id] = None
-            
-        db_player = db.q(f"select * from {players} where {players.c.id} = '{task_manager.all_users[user_id]}'")
-    
-        if not db_player:
-            current_points = 20
-            players.insert({'name': user_id, 'points': current_points})
-            query = f"SELECT {players.c.id} FROM {players} WHERE {players.c.name} = ?"
-            result = db.q(query, (user_id,))
-            task_manager.all_users[user_id] = result[0]['id']
-        else:
-            current_points = db_player[0]['points']
 
+@rt('/room/{room_id}')
+async def get(session, app, room_id: str):
+    return await game_page(session, requested=room_id)
+
+
+async def game_page(session, requested=None):
+    user_id = session['session_id'] if 'session_id' in session else None
+    entry = await call_game(session, 'enter', {'requested': requested, 'current': session.get('room'), 'session_id': user_id})
+    if entry is None:
+        return Title("Guess the word"), Div(tabs, cls="container")
+    room_id = entry['room']
+    session['room'] = room_id
 
-    
     if user_id:
-        top_right_corner = Div(user_id + ": " + str(current_points) + " pts", cls='login', id='login_points')
+        player = PlayerRecord(**entry['player'])
+        top_right_corner = login_points_div(player)
     else:
         lbtn = Div(
             A(
@@ -435,10 +809,33 @@ async def get(session, app, request):
         main_tabs,
         main_content,
         cls="container",
-        hx_ext='ws', ws_connect='/ws'
+        hx_ext='ws', ws_connect=f'/ws/{room_id}'
     )
     
-    return Title("Guess the word"), Div(container, enterToGuess())
+    return Title("Guess the word"), Div(container, enterToGuess(), countdownTicker(), trimGuessFeed(env_vars.GUESSES_FEED_SIZE))
+
+def outbox_depths():
+    depths = [len(outbox.pending) for outbox in hub.broadcaster.outboxes.values()]
+    return {('max',): max(depths, default=0), ('total',): sum(depths)}
+
+
+def websockets_per_user():
+    # only the worker running the game knows every room's online users
+    rooms = getattr(app.state, 'rooms', None)
+    if rooms is None:
+        return {}
+    return {(room_id, key): len(data['ws_clients']) for room_id, room in list(rooms.rooms.items()) for key, data in room.online_users.snapshot()}
+
+
+metrics.Gauge("gtw_ws_outbox_depth", "Fragments waiting in the outbound queues of this worker's websockets", outbox_depths, labels=("stat",))
+metrics.Gauge("gtw_worker_websockets", "Websockets connected to this worker", lambda: {(): len(hub.connections)})
+metrics.Gauge("gtw_online_websockets", "Websockets connected to a room, per online_users key", websockets_per_user, labels=("room", "user"))
+
+
+@rt("/metrics")
+def get():
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
 
 @rt("/how-to-play")
 def get(app, session):
@@ -453,162 +850,238 @@ async def get(session, app, request):
         cls="container"
     )
 
-def guess_form(disable_var: bool = False):
+def guess_form(room_id: str, disable_var: bool = False):
     return Div(Form(
         Input(type='text', name='guess', placeholder="Guess the word", maxlength=f"{env_vars.WORD_MAX_LENGTH}",
               required=True, autofocus=True, disabled=disable_var),
-        Button('GUESS', cls='primary', style='width: 100%;', id="guess_btn"),
-        action='/', hx_post='/guess', style='border: 5px solid #eaf6f6; padding: 10px; width: 100%; margin: 10px auto;',
+        Button('GUESS', cls='primary', id="guess_btn"),
+        action='/', hx_post=f'/room/{room_id}/guess', cls='guess-form',
         id='guess_form'), hx_swap="outerHTML"
     )
 
-@rt("/guess")
-async def post(session, guess: str):
+@rt("/room/{room_id}/guess")
+async def post(session, room_id: str, guess: str):
+    start = metrics.start_timer()
+    try:
+        form, result = await submit_guess(session, room_id, guess)
+    finally:
+        metrics.GUESS_SECONDS.observe_since(start)
+    metrics.GUESSES.inc(result)
+    return form
+
+
+async def submit_guess(session, room_id: str, guess: str):
+    "The guess form to send back and how the guess went: correct, wrong or rejected"
     if 'session_id' not in session:
         add_toast(session, SIGN_IN_TEXT, "error")
-        return guess_form()
-    
-    task_manager = app.state.task_manager
+        return guess_form(room_id), 'rejected'
+
+    if not guess_limiter.allow(session['session_id']):
+        add_toast(session, "You are guessing too fast, slow down", "error")
+        return guess_form(room_id), 'rejected'
 
     guess = guess.strip()
 
     if " " in guess:
         add_toast(session, "You can only send one word", "error")
-        return guess_form()
+        return guess_form(room_id), 'rejected'
 
     if len(guess) > env_vars.WORD_MAX_LENGTH:
         add_toast(session, f"The guess max length is {env_vars.WORD_MAX_LENGTH} characters", "error")
-        return guess_form()
+        return guess_form(room_id), 'rejected'
 
     if len(guess) == 0:
         add_toast(session, "Cannot send empty guess", "error")
-        return guess_form()
-    
-    user_id = session['session_id']
-            
-    db_player = db.q(f"select * from {players} where {players.c.id} = '{task_manager.all_users[user_id]}'")
+        return guess_form(room_id), 'rejected'
+
+    reply = await call_game(session, 'guess', {'room': room_id, 'session_id': session['session_id'], 'guess': guess})
+    if reply is None:
+        return guess_form(room_id), 'rejected'
+    add_toasts(session, reply)
+    return guess_form(room_id, disable_var=reply['disabled']), reply['result']
+
+
+async def place_guess(payload):
+    task_manager = app.state.rooms.get(payload['room'])
+    if task_manager is None:
+        return game_reply(("This room has closed, reload the page to join another one", "error"))
+    return await task_manager.queue_guess(payload)
+
+
+def judge_guess(task_manager, payload):
+    "Runs on the room's guess consumer, without awaiting, so two guesses never see the round half updated"
+    if task_manager.current_word is None:
+        return game_reply(("The round is about to start", "info"))
+
+    guess = payload['guess']
+    player = player_store.get(payload['session_id'])
+    if player is None:
+        return game_reply((SIGN_IN_TEXT, "error"))
 
     guess_dict = {
         'guess': guess,
-        'user_id': db_player[0]['name']
+        'user_id': player.name
     }
 
     if guess.lower() == task_manager.current_word.word.lower():
         guess_dict['guess'] = 'answered correctly'
-        db_winner = db_player[0]
-        winner_name = db_winner['name']
+        winner_name = player.name
         if winner_name in task_manager.current_winners:
-            add_toast(session, "Cannot guess correctly again", "error")
-            return guess_form()
-        async with task_manager.current_winners_lock:
-            task_manager.current_winners.append(winner_name)
-        db_winner['points'] += int(50 * task_manager.countdown_var / env_vars.WORD_COUNTDOWN_SEC)
-        players.update(db_winner)
-        elem = Div(winner_name + ": " + str(db_winner['points']) + " pts", cls='login', id='login_points')
-
-        for client in task_manager.online_users[winner_name]['ws_clients']:
-            await task_manager.send_to_clients(elem, client)
-        await task_manager.broadcast_leaderboard()
-        task_manager.guesses.append(guess_dict)
-        await task_manager.broadcast_guesses()
-        logging.debug(f"{winner_name} guessed correctly")
-        return guess_form(disable_var=True)
+            return game_reply(("Cannot guess correctly again", "error"))
+        task_manager.current_winners.append(winner_name)
+        player_store.set_points(player, player.points + int(50 * task_manager.countdown_var / env_vars.WORD_COUNTDOWN_SEC))
+        leaderboard.update(player.id, winner_name, player.points)
+        event_log.append({'t': 'win', 'room': task_manager.room_id, 'name': winner_name, 'player_id': player.id, 'points': player.points})
+
+        task_manager.new_points[winner_name] = player
+        task_manager.add_guess(guess_dict)
+        logging.debug("%s guessed correctly", winner_name)
+        return game_reply(disabled=True, result='correct')
     else:
-        if similar(guess.lower(), task_manager.current_word.word.lower()) >= 0.75:
-            add_toast(session, "You're close!", "info")
-        task_manager.guesses.append(guess_dict)
-        await task_manager.broadcast_guesses()
-        logging.debug(f"Guess: {guess} from {db_player[0]['name']}")
-        return guess_form()
-
-def buy_form():
+        toasts = [("You're close!", "info")] if task_manager.matcher.is_close(guess) else []
+        task_manager.add_guess(guess_dict)
+        logging.debug("Guess: %s from %s", guess, player.name)
+        return game_reply(*toasts, result='wrong')
+
+def buy_form(room_id: str):
     return Div(Form(
-            Button('BUY A LETTER', cls='primary', style='width: 100%;', id="buy_btn"),
-            action='/', hx_post='/buy', style='padding: 10px; width: 50%; margin: 10px auto;',
+            Button('BUY A LETTER', cls='primary', id="buy_btn"),
+            action='/', hx_post=f'/room/{room_id}/buy', cls='buy-form',
             id='buy_form'), hx_swap="outerHTML"
         )
 
-@rt("/buy")
-async def post(session):
+@rt("/room/{room_id}/buy")
+async def post(session, room_id: str):
     if 'session_id' not in session:
         add_toast(session, SIGN_IN_TEXT, "error")
-        return buy_form()
-    
-    task_manager = app.state.task_manager
+        return buy_form(room_id)
+
+    if not buy_limiter.allow(session['session_id']):
+        add_toast(session, "You are buying too fast, slow down", "error")
+        return buy_form(room_id)
+
+    reply = await call_game(session, 'buy', {'room': room_id, 'session_id': session['session_id']})
+    if reply is not None:
+        add_toasts(session, reply)
+    return buy_form(room_id)
+
 
-    user_id = session['session_id']
+async def buy_letter(payload):
+    task_manager = app.state.rooms.get(payload['room'])
+    if task_manager is None:
+        return game_reply(("This room has closed, reload the page to join another one", "error"))
 
-    db_player = db.q(f"select * from {players} where {players.c.id} = '{task_manager.all_users[user_id]}'")[0]
+    user_id = payload['session_id']
 
-    if db_player in task_manager.current_winners:
-        add_toast(session, "No need to buy anymore letters", "info")
-        return buy_form()
+    player = player_store.get(user_id)
+    if player is None:
+        return game_reply((SIGN_IN_TEXT, "error"))
+
+    if player.name in task_manager.current_winners:
+        return game_reply(("No need to buy anymore letters", "info"))
 
     if user_id in task_manager.online_users:
         try:
-            if len(task_manager.online_users[user_id]['available_letters']) == 0:
-                add_toast(session, "Cannot buy anymore letters", "error")
-                return buy_form()
-            if db_player['points'] < 10:
-                add_toast(session, "Cannot buy anymore letters", "error")
-                return buy_form()  
-            letter = random.choice(task_manager.online_users[user_id]['available_letters'])
-            task_manager.online_users[user_id]['letters_shown'].append(letter)
-            task_manager.online_users[user_id]['available_letters'].remove(letter)
-            task_manager.current_winners.append(db_player)
-            db_player['points'] -= 10
-            players.update(db_player)
-            elem = Div(db_player['name'] + ": " + str(db_player['points']) + " pts", cls='login', id='login_points')
-            for client in task_manager.online_users[db_player['name']]['ws_clients']:
-                await task_manager.send_to_clients(elem, client)
-            await task_manager.broadcast_leaderboard()
+            available = task_manager.buyable_mask & ~task_manager.online_users[user_id]['letters_mask']
+            if available == 0:
+                return game_reply(("Cannot buy anymore letters", "error"))
+            if player.points < 10:
+                return game_reply(("Cannot buy anymore letters", "error"))
+            letter = random.choice(mask_positions(available))
+            task_manager.online_users[user_id]['letters_mask'] |= 1 << letter
+            player_store.set_points(player, player.points - 10)
+            leaderboard.update(player.id, player.name, player.points)
+            event_log.append({'t': 'buy', 'room': task_manager.room_id, 'user': user_id, 'letter': letter, 'player_id': player.id, 'points': player.points})
+            await task_manager.send_to_user(login_points_div(player), player.name)
         except IndexError:
-            add_toast(session, "Cannot buy anymore letters", "error")
+            return game_reply(("Cannot buy anymore letters", "error"))
+
+    return game_reply()
+
 
-    return buy_form()
+async def enter_game(payload):
+    room = app.state.rooms.assign(requested=payload['requested'], current=payload['current'])
+    player = None
+    if payload['session_id']:
+        player = player_store.get(payload['session_id'])
+        if player is None:
+            player = player_store.create(payload['session_id'], 20)
+            leaderboard.update(player.id, player.name, player.points)
+    return {'room': room.room_id, 'player': player and {'id': player.id, 'name': player.name, 'points': player.points}}
 
 
-async def on_connect(send, ws):
-    client_key = "unassigned_clients"
-    if ws.scope['session'] and ws.scope['session']['session_id']:
-        client_key = ws.scope['session']['session_id']        
-    task_manager = app.state.task_manager
-    with task_manager.online_users_lock:
-        if client_key not in task_manager.online_users:
-            task_manager.online_users[client_key] = { 'ws_clients': set(), 'combo_count': 0, 'letters_shown': task_manager.current_letters, 'available_letters': list(set([i for i in range(len(task_manager.current_word.word)) if i not in task_manager.random_letters]) - set(task_manager.current_letters))}
-        task_manager.online_users[client_key]['ws_clients'].add(send)
-    if task_manager.current_word:
-        await task_manager.broadcast_current_word(send)
-    await task_manager.broadcast_guesses(send)
-    await task_manager.broadcast_leaderboard(send)
-    await task_manager.send_to_clients(client=send, element=Div(guess_form(), id='guess_form'))
-    await task_manager.send_to_clients(client=send, element=Div(buy_form(), id='buy_form'))
+async def connect_client(payload):
+    task_manager = app.state.rooms.get(payload['room'])
+    if task_manager is None:
+        return None
+    task_manager.add_client(payload['key'], payload['conn'])
+    return task_manager.initial_fragments(payload['key'])
 
 
-async def on_disconnect(send, session):
+async def disconnect_client(payload):
+    task_manager = app.state.rooms.get(payload['room'])
+    if task_manager:
+        task_manager.remove_client(payload['conn'])
+
+
+def game_reply(*toasts, disabled=False, result='rejected'):
+    "Reply of the game server to a guess or a buy, applied to the player's session by the worker that got the request"
+    return {'toasts': [list(toast) for toast in toasts], 'disabled': disabled, 'result': result}
+
+
+def add_toasts(session, reply):
+    for message, kind in reply['toasts']:
+        add_toast(session, message, kind)
+
+
+async def call_game(session, command, payload):
+    "Run `command` on the game server; None, with an error toast, when it does not answer"
+    try:
+        return await bus.call(command, payload)
+    except Exception as e:
+        logging.warning(f"Game server call {command} failed: {e!r}")
+        add_toast(session, "The game server is restarting, please try again in a moment", "error")
+        return None
+
+
+async def on_connect(ws):
+    client_key = ANONYMOUS
+    if ws.scope['session'] and ws.scope['session'].get('session_id'):
+        client_key = ws.scope['session']['session_id']
+    room_id = ws.path_params['room_id']
+    conn_id = hub.add(room_id, client_key, ws)
+    try:
+        fragments = await bus.call('connect', {'room': room_id, 'key': client_key, 'conn': conn_id})
+    except Exception as e:
+        logging.warning(f"Game server call connect failed: {e!r}")
+        await hub.disconnect(ws)
+        # 1013 (try again later) makes htmx reconnect
+        await ws.close(1013)
+        return
+    if fragments is None:
+        await hub.disconnect(ws)
+        await ws.close()
+        return
+    await hub.send(ws, fragments)
+
+
+async def on_disconnect(ws, session):
     logging.debug("Calling on_disconnect")
-    logging.debug(len(app.state.task_manager.online_users))
-    task_manager = app.state.task_manager
-    with task_manager.online_users_lock:
-        key_to_remove = None
-        for key, user_data in task_manager.online_users.items():
-            if send in user_data['ws_clients']:
-                user_data['ws_clients'].remove(send)
-                if len(user_data['ws_clients']) == 0:
-                    key_to_remove = key
-                break
-            
-        if key_to_remove:
-            task_manager.online_users.pop(key_to_remove)
-                    
-        if session:
-            session['session_id'] = None
+    # FastHTML hands every handler a new `send` partial, so the hub knows clients by their websocket
+    await hub.disconnect(ws)
+    if session:
+        session['session_id'] = None
 
 
-@app.ws('/ws', conn=on_connect, disconn=on_disconnect)
+@app.ws('/ws/{room_id}', conn=on_connect, disconn=on_disconnect)
 async def ws(send):
     pass
 
 if __name__ == '__main__':
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=7860)
\ No newline at end of file
+    if env_vars.WEB_WORKERS > 1:
+        if not bus.shared:
+            raise SystemExit("WEB_WORKERS > 1 needs GAME_BUS=sqlite, otherwise every worker runs its own game")
+        uvicorn.run("app:app", host="0.0.0.0", port=7860, workers=env_vars.WEB_WORKERS, ws_per_message_deflate=env_vars.WS_PER_MESSAGE_DEFLATE)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=7860, ws_per_message_deflate=env_vars.WS_PER_MESSAGE_DEFLATE)
\ No newline at end of file
@@ -1,6 +1,17 @@
 from fasthtml.oauth import _AppClient, WebApplicationClient
+from oauthlib.oauth2.rfc6749.parameters import parse_token_response
+import asyncio
+import httpx
 import secrets
 from fastcore.basics import patch
+import env_vars
+
+# one pooled client for every login; the semaphore keeps a login storm from opening a connection per request
+oauth_http = httpx.AsyncClient(
+    timeout=env_vars.OAUTH_TIMEOUT_SEC,
+    limits=httpx.Limits(max_connections=env_vars.OAUTH_MAX_CONCURRENCY, max_keepalive_connections=env_vars.OAUTH_MAX_CONCURRENCY),
+)
+oauth_slots = asyncio.Semaphore(env_vars.OAUTH_MAX_CONCURRENCY)
 
 class HuggingFaceClient(_AppClient):
     "A `WebApplicationClient` for HuggingFace oauth2"
@@ -21,4 +32,16 @@ def login_link_with_state(self:WebApplicationClient, scope=None, state=None):
     "Get a login link for this client"
     if not scope: scope=self.scope
     if not state: state=self.state
-    return self.prepare_request_uri(self.base_url, self.redirect_uri, scope, state)
\ No newline at end of file
+    return self.prepare_request_uri(self.base_url, self.redirect_uri, scope, state)
+@patch
+async def retr_info_async(self:_AppClient, code):
+    "`retr_info` on the shared async client. The token stays local to the call, since the client object is shared by every login."
+    payload = dict(code=code, redirect_uri=self.redirect_uri, client_id=self.client_id,
+                   client_secret=self.client_secret, grant_type='authorization_code')
+    async with oauth_slots:
+        response = await oauth_http.post(self.token_url, json=payload)
+        token = parse_token_response(response.text, scope=self.scope)
+        headers = {'Authorization': f'Bearer {token["access_token"]}'}
+        response = await oauth_http.get(self.info_url, headers=headers)
+    response.raise_for_status()
+    return response.json()
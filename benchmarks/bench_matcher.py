@@ -0,0 +1,85 @@
+"""Micro-benchmark of the "you're close" check: `difflib.SequenceMatcher` (as `/guess` used it) against `NearMissMatcher`.
+
+Targets and guesses are drawn from the `words` table of guess.db. Half of the guesses are other dataset
+words, the other half are typo'd versions of the target, so both the fast reject and the full scan are exercised.
+
+    python benchmarks/bench_matcher.py --rounds 200 --guesses 300
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from difflib import SequenceMatcher
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import env_vars
+from matcher import NearMissMatcher
+
+
+def similar(a, b):
+    return SequenceMatcher(None, a, b).ratio()
+
+
+def typo(word):
+    i = random.randrange(len(word))
+    op = random.choice('sdi')
+    ch = random.choice('abcdefghijklmnopqrstuvwxyz')
+    if op == 's':
+        return word[:i] + ch + word[i + 1:]
+    if op == 'd':
+        return word[:i] + word[i + 1:]
+    return word[:i] + ch + word[i:]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', default=f'{env_vars.DB_DIRECTORY}guess.db')
+    parser.add_argument('--rounds', type=int, default=200)
+    parser.add_argument('--guesses', type=int, default=300, help='guesses per round')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    conn = sqlite3.connect(args.db)
+    vocab = [row[0].lower() for row in conn.execute("SELECT word FROM words")]
+    conn.close()
+    if not vocab:
+        sys.exit(f"No words in {args.db}")
+
+    rounds = []
+    for _ in range(args.rounds):
+        target = random.choice([w for w in random.sample(vocab, min(len(vocab), 50)) if len(w) > 5] or vocab)
+        guesses = [random.choice(vocab) if random.random() < 0.5 else typo(target) for _ in range(args.guesses)]
+        rounds.append((target, guesses))
+    total = args.rounds * args.guesses
+
+    start = time.perf_counter()
+    baseline = [[similar(g, target) >= env_vars.CLOSE_GUESS_THRESHOLD for g in guesses] for target, guesses in rounds]
+    t_similar = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matched = []
+    for target, guesses in rounds:
+        matcher = NearMissMatcher(target)
+        matched.append([matcher.is_close(g) for g in guesses])
+    t_matcher = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for target, guesses in rounds:
+        matcher = NearMissMatcher(target)
+        for g in guesses:
+            matcher._is_close(g)
+    t_uncached = time.perf_counter() - start
+
+    differ = sum(a != b for ra, rb in zip(baseline, matched) for a, b in zip(ra, rb))
+    print(f"{total} guesses over {args.rounds} rounds, {len(vocab)} words in the dataset")
+    print(f"SequenceMatcher        {t_similar * 1e6 / total:8.2f} us/guess")
+    print(f"NearMissMatcher        {t_matcher * 1e6 / total:8.2f} us/guess  ({t_similar / t_matcher:.1f}x)")
+    print(f"  without verdict cache {t_uncached * 1e6 / total:7.2f} us/guess  ({t_similar / t_uncached:.1f}x)")
+    print(f"verdicts that differ: {differ} ({differ / total:.3%}); SequenceMatcher can under-count the LCS")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""Login storm against a local stub OAuth provider: the old callbacks (sync `retr_info` on Starlette's thread pool)
+against `retr_info_async` on the shared httpx client.
+
+The stub answers /token and /userinfo after `--delay` seconds and derives the user from the code, so a login
+that comes back with somebody else's info is counted as mixed up. While the logins run, a 10 ms ticker
+measures how late the event loop wakes up. The script exits with 1 when any login failed or was mixed up.
+
+    python benchmarks/bench_oauth.py --logins 200 --delay 0.5
+    python benchmarks/bench_oauth.py --serve    # just the stub, for HF_TOKEN_URL=http://127.0.0.1:8765/token etc.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from starlette.concurrency import run_in_threadpool
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from auth import HuggingFaceClient
+
+
+def stub_app(delay: float):
+    async def token(request):
+        payload = await request.json()
+        await asyncio.sleep(delay)
+        return JSONResponse({'access_token': f"token-{payload['code']}", 'token_type': 'Bearer', 'scope': 'openid profile'})
+
+    async def userinfo(request):
+        code = request.headers['authorization'].removeprefix('Bearer token-')
+        await asyncio.sleep(delay)
+        return JSONResponse({'sub': code, 'preferred_username': f"user-{code}", 'name': f"user-{code}"})
+
+    return Starlette(routes=[Route('/token', token, methods=['POST']), Route('/userinfo', userinfo)])
+
+
+def serve_in_thread(app, port: int):
+    server = uvicorn.Server(uvicorn.Config(app, port=port, log_level='warning'))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def measure(name, logins):
+    lag = []
+
+    async def ticker():
+        while True:
+            before = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lag.append(time.perf_counter() - before - 0.01)
+
+    tick_task = asyncio.create_task(ticker())
+    start = time.perf_counter()
+    results = await asyncio.gather(*logins, return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    tick_task.cancel()
+    errors = [r for r in results if isinstance(r, Exception)]
+    mixed = sum(1 for code, r in enumerate(results) if isinstance(r, dict) and r.get('sub') != str(code))
+    print(f"{name:28} {elapsed:6.2f}s  max loop lag {max(lag, default=0) * 1000:6.1f} ms  errors {len(errors)}  mixed up {mixed}")
+    return len(errors) + mixed
+
+
+async def run(args) -> int:
+    "Run both variants and return how many logins failed or got someone else's user info"
+    base = f"http://127.0.0.1:{args.port}"
+    client = HuggingFaceClient("client-id", "client-secret", redirect_uri="http://localhost/auth/callback")
+    client.token_url, client.info_url = f"{base}/token", f"{base}/userinfo"
+    failures = await measure("sync retr_info, thread pool", [run_in_threadpool(client.retr_info, str(code)) for code in range(args.logins)])
+    failures += await measure("retr_info_async", [client.retr_info_async(str(code)) for code in range(args.logins)])
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--delay', type=float, default=0.5, help='seconds the stub takes per request')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--serve', action='store_true', help='only run the stub provider')
+    args = parser.parse_args()
+    if args.serve:
+        uvicorn.run(stub_app(args.delay), port=args.port)
+        return
+    serve_in_thread(stub_app(args.delay), args.port)
+    print(f"{args.logins} logins, stub provider answering in {args.delay}s per request")
+    if asyncio.run(run(args)):
+        # a wrong answer is a failed check, not just a slow run
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+"""Load generator for the game server: N signed-in websocket clients plus a steady rate of /guess and /buy posts.
+
+By default the app is started with uvicorn in a subprocess on localhost. It gets a throw-away database filled from
+synthetic words, and rate limits off. Nobody goes through OAuth: session cookies are signed with the server's
+own .sesskey. Pass --url (and --session-key) to load a server that is already running.
+
+Reported, and written as JSON so runs can be compared between versions:
+  broadcast latency  time from posting a guess until its row shows up on each client of the room (p50/p99)
+  tick jitter        lateness of the round ticks, from the server's /metrics (p50/p99/max)
+  guesses/s          /guess posts answered per second
+  bytes per client   websocket bytes received per client per round: message payloads, and the bytes that came off the
+                     socket (frames after permessage-deflate)
+  memory per conn    growth of the server's RSS per connected websocket
+
+Besides requirements.txt this needs two dev dependencies: websockets 14 or newer (for `additional_headers`) and
+itsdangerous, to sign the session cookies (python-fasthtml pulls it in, but it is imported here directly).
+
+    pip install 'websockets>=14,<18' 'itsdangerous>=2,<3'
+    python benchmarks/loadgen.py --clients 200 --guess-rate 50 --duration 60 --out results.json
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import websockets
+from itsdangerous import TimestampSigner
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = re.compile(r'lg\d+x')
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def rss_kib(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+
+def parse_metrics(text):
+    "{name: [(labels dict, value)]} from the Prometheus text format"
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        match = re.match(r'([a-zA-Z_:][\w:]*)(?:\{(.*)\})? (\S+)$', line)
+        if match:
+            name, labels, value = match.groups()
+            labels = dict(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', labels or ''))
+            samples.setdefault(name, []).append((labels, float(value)))
+    return samples
+
+
+def histogram_quantile(samples, name, q):
+    "Upper bound of the bucket holding quantile `q`, as Prometheus' histogram_quantile would place it"
+    buckets = sorted(((float(labels['le']), value) for labels, value in samples.get(f'{name}_bucket', [])), key=lambda b: b[0])
+    if not buckets or buckets[-1][1] == 0:
+        return None
+    rank = q * buckets[-1][1]
+    for bound, count in buckets:
+        if count >= rank:
+            return bound
+    return buckets[-1][0]
+
+
+class Server:
+    "The app under uvicorn in a subprocess, in a temporary directory with its own database and session key"
+
+    def __init__(self, args):
+        self.dir = tempfile.mkdtemp(prefix='gtw-load-')
+        words = os.path.join(self.dir, 'words.jsonl')
+        with open(words, 'w') as f:
+            for i in range(args.words):
+                word = ''.join(random.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(random.randint(6, 10)))
+                f.write(json.dumps({'word': word, **{f'hint #{n}': f'hint {n} for word {i}' for n in range(1, 6)}}) + '\n')
+        env = dict(os.environ, DB_DIRECTORY=self.dir + '/', WORDS_SOURCE=words, WORD_COUNTDOWN_SEC=str(args.round_sec),
+                   GUESS_RATE_PER_SEC='0', BUY_RATE_PER_SEC='0', ROOM_CAPACITY=str(max(args.clients, 1)), PYTHONPATH=ROOT)
+        env.update(dict(item.split('=', 1) for item in args.env))
+        self.log = open(os.path.join(self.dir, 'server.log'), 'w')
+        self.proc = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'app:app', '--port', str(args.port), '--log-level', 'warning',
+                                      '--ws-per-message-deflate', str(args.ws_deflate == 'on').lower()],
+                                     cwd=self.dir, env=env, stdout=self.log, stderr=subprocess.STDOUT)
+        self.url = f'http://127.0.0.1:{args.port}'
+        self.session_key = os.path.join(self.dir, '.sesskey')
+
+    async def wait_ready(self, timeout=60):
+        deadline = time.monotonic() + timeout
+        async with httpx.AsyncClient() as http:
+            while time.monotonic() < deadline:
+                if self.proc.poll() is not None:
+                    sys.exit(f"Server exited, see {self.log.name}")
+                try:
+                    if (await http.get(f'{self.url}/metrics')).status_code == 200:
+                        return
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.2)
+        sys.exit(f"Server did not start in {timeout}s, see {self.log.name}")
+
+    def stop(self):
+        self.proc.terminate()
+        self.proc.wait()
+        self.log.close()
+
+
+class Client:
+    def __init__(self, n, cookie, compression='deflate'):
+        self.name = f'load{n}#{n:04d}'
+        self.cookie = cookie
+        self.compression = compression
+        self.room = None
+        self.bytes = 0
+        self.wire_bytes = 0
+        self.messages = 0
+        self.seen = set()
+        self.ws = None
+
+    async def join(self, http, url):
+        page = await http.get(f'{url}/', headers={'Cookie': f'session_={self.cookie}'})
+        self.room = re.search(r'ws-connect="/ws/([^"]+)"', page.text).group(1)
+        self.ws = await websockets.connect(url.replace('http', 'ws', 1) + f'/ws/{self.room}',
+                                           additional_headers={'Cookie': f'session_={self.cookie}'}, max_size=None,
+                                           compression=self.compression)
+        # the connection is the asyncio protocol of its socket: count what the transport hands it
+        data_received = self.ws.data_received
+
+        def count_wire_bytes(data):
+            self.wire_bytes += len(data)
+            data_received(data)
+        self.ws.data_received = count_wire_bytes
+
+    async def read(self, sent, latencies):
+        async for message in self.ws:
+            now = time.perf_counter()
+            self.bytes += len(message.encode() if isinstance(message, str) else message)
+            self.messages += 1
+            for token in TOKEN.findall(message):
+                if token not in self.seen and token in sent:
+                    self.seen.add(token)
+                    latencies.append(now - sent[token])
+
+
+async def post_at_rate(rate, duration, post):
+    "Call `post()` `rate` times per second for `duration` seconds, without waiting for the answers"
+    if rate <= 0:
+        return []
+    tasks = []
+    start = time.perf_counter()
+    n = 0
+    while time.perf_counter() - start < duration:
+        tasks.append(asyncio.create_task(post()))
+        n += 1
+        await asyncio.sleep(max(0.0, start + n / rate - time.perf_counter()))
+    return await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def run(args):
+    server = None
+    if args.url:
+        url, key_file = args.url.rstrip('/'), args.session_key
+    else:
+        server = Server(args)
+        url, key_file = server.url, server.session_key
+        await server.wait_ready()
+    try:
+        signer = TimestampSigner(open(key_file).read().strip())
+        cookie = lambda name: signer.sign(base64.b64encode(json.dumps({'session_id': name}).encode())).decode()
+        limits = httpx.Limits(max_connections=args.http_connections)
+        async with httpx.AsyncClient(limits=limits, timeout=30) as http:
+            pid = server.proc.pid if server else args.pid
+            rss_before = rss_kib(pid) if pid else None
+            clients = [Client(n, None, 'deflate' if args.ws_deflate == 'on' else None) for n in range(args.clients)]
+            for client in clients:
+                client.cookie = cookie(client.name)
+            for batch in range(0, len(clients), 50):
+                await asyncio.gather(*(client.join(http, url) for client in clients[batch:batch + 50]))
+            await asyncio.sleep(1)
+            rss_after = rss_kib(pid) if pid else None
+
+            sent, latencies = {}, []
+            readers = [asyncio.create_task(client.read(sent, latencies)) for client in clients]
+            counter = iter(range(10 ** 12))
+            answered = []
+
+            async def guess():
+                client = random.choice(clients)
+                token = f'lg{next(counter)}x'
+                sent[token] = time.perf_counter()
+                response = await http.post(f'{url}/room/{client.room}/guess', data={'guess': token}, headers={'Cookie': f'session_={client.cookie}'})
+                answered.append(response.status_code == 200)
+
+            async def buy():
+                client = random.choice(clients)
+                await http.post(f'{url}/room/{client.room}/buy', headers={'Cookie': f'session_={client.cookie}'})
+
+            bytes_before = sum(client.bytes for client in clients)
+            wire_before = sum(client.wire_bytes for client in clients)
+            start = time.perf_counter()
+            await asyncio.gather(post_at_rate(args.guess_rate, args.duration, guess), post_at_rate(args.buy_rate, args.duration, buy))
+            await asyncio.sleep(1)
+            elapsed = time.perf_counter() - start
+            received = sum(client.bytes for client in clients) - bytes_before
+            wire = sum(client.wire_bytes for client in clients) - wire_before
+            metrics = parse_metrics((await http.get(f'{url}/metrics')).text)
+            for client in clients:
+                await client.ws.close()
+            for reader in readers:
+                reader.cancel()
+    finally:
+        if server:
+            server.stop()
+
+    round_sec = args.round_sec
+    rounds = elapsed / round_sec
+    lateness = metrics.get('gtw_tick_lateness_seconds_count', [({}, 0)])[0][1]
+    return {
+        'config': {key: value for key, value in vars(args).items() if key not in ('session_key',)},
+        'git_rev': subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip() or None,
+        'elapsed_sec': elapsed,
+        'broadcast_latency_ms': {
+            'samples': len(latencies),
+            'p50': (percentile(latencies, 0.5) or 0) * 1000,
+            'p99': (percentile(latencies, 0.99) or 0) * 1000,
+        },
+        'tick_jitter_ms': {
+            'ticks': lateness,
+            'p50_upper_bound': (histogram_quantile(metrics, 'gtw_tick_lateness_seconds', 0.5) or 0) * 1000,
+            'p99_upper_bound': (histogram_quantile(metrics, 'gtw_tick_lateness_seconds', 0.99) or 0) * 1000,
+            'skipped': sum(value for _, value in metrics.get('gtw_ticks_skipped_total', [])),
+        },
+        'guesses_per_sec': sum(answered) / args.duration,
+        'guesses_failed': len(answered) - sum(answered),
+        'bytes_per_client_per_round': received / max(len(clients), 1) / rounds,
+        'wire_bytes_per_client_per_round': wire / max(len(clients), 1) / rounds,
+        'messages_per_client': sum(client.messages for client in clients) / max(len(clients), 1),
+        'memory_per_connection_kib': (rss_after - rss_before) / len(clients) if rss_before and rss_after and clients else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--guess-rate', type=float, default=20, help='/guess posts per second, over all clients')
+    parser.add_argument('--buy-rate', type=float, default=2, help='/buy posts per second, over all clients')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of load after every client connected')
+    parser.add_argument('--round-sec', type=int, default=20, help='WORD_COUNTDOWN_SEC of the server we start')
+    parser.add_argument('--words', type=int, default=2000)
+    parser.add_argument('--port', type=int, default=8790)
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE', help='extra environment for the server we start')
+    parser.add_argument('--ws-deflate', choices=['on', 'off'], default='on', help='permessage-deflate on the websockets')
+    parser.add_argument('--http-connections', type=int, default=100)
+    parser.add_argument('--url', help='load an already running server instead of starting one')
+    parser.add_argument('--session-key', default='.sesskey', help='with --url: the server\'s session key file')
+    parser.add_argument('--pid', type=int, help='with --url: server pid, to measure memory per connection')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='write the results here as JSON (default: stdout)')
+    args = parser.parse_args()
+    random.seed(args.seed)
+    results = asyncio.run(run(args))
+    text = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
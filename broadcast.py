@@ -0,0 +1,135 @@
+from fasthtml.common import to_xml
+from collections import OrderedDict
+import asyncio
+import itertools
+import logging
+from dataclasses import dataclass
+import env_vars
+import metrics
+
+
+@dataclass(frozen=True)
+class Fragment:
+    "Html rendered ahead of time, with the DOM id it targets (None when it targets several elements)"
+    key: object
+    html: str
+
+
+def render(element):
+    "Render `element` once to the html text that is written to every websocket"
+    if isinstance(element, Fragment):
+        return element.html
+    return element if isinstance(element, str) else to_xml(element)
+
+
+def prerender(*elements):
+    "Render `elements` into one `Fragment`, sent to each client as a single websocket message"
+    key = element_id(elements[0]) if len(elements) == 1 else None
+    return Fragment(key, ''.join(render(element) for element in elements))
+
+
+def element_id(element):
+    "The DOM id a fragment targets, or None for fragments that must never be coalesced"
+    if isinstance(element, Fragment):
+        return element.key
+    attrs = getattr(element, 'attrs', None)
+    return attrs.get('id') if isinstance(attrs, dict) else None
+
+
+async def close_client(ws, code: int = 1000):
+    try:
+        await ws.close(code)
+    except Exception:
+        pass
+
+
+class ClientOutbox:
+    "Bounded outbound queue of one websocket, drained by its own writer task. Latest fragment per DOM id wins."
+
+    def __init__(self, ws, on_fail, maxsize: int = env_vars.WS_OUTBOX_MAX_FRAGMENTS, timeout: float = env_vars.WS_SEND_TIMEOUT_SEC):
+        self.ws = ws
+        self.on_fail = on_fail
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.pending = OrderedDict()
+        self.ready = asyncio.Event()
+        self.task = asyncio.create_task(self._writer())
+
+    def put(self, key, html) -> bool:
+        "Queue `html` under `key`, replacing a pending fragment with the same key. False when the queue is full."
+        if isinstance(key, str):
+            # a full replacement of an element makes the appends still queued for it redundant
+            for stale in [k for k in self.pending if isinstance(k, tuple) and k[0] == key]:
+                del self.pending[stale]
+        if key in self.pending:
+            self.pending[key] = html
+            # the newer version goes behind whatever was queued since, e.g. a round reset that blanks this element
+            self.pending.move_to_end(key)
+        elif len(self.pending) >= self.maxsize:
+            return False
+        else:
+            self.pending[key] = html
+        self.ready.set()
+        return True
+
+    async def _writer(self):
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            while self.pending:
+                _, html = self.pending.popitem(last=False)
+                try:
+                    await asyncio.wait_for(self.ws.send_text(html), self.timeout)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    metrics.WS_SEND_FAILURES.inc('timeout' if isinstance(e, asyncio.TimeoutError) else 'error')
+                    logging.debug("Websocket send failed (%s), evicting %s", type(e).__name__, self.ws)
+                    self.pending.clear()
+                    await self.on_fail(self.ws)
+                    return
+
+    def close(self):
+        self.pending.clear()
+        if self.task is not asyncio.current_task():
+            self.task.cancel()
+
+
+class Broadcaster:
+    """Renders a fragment once and hands it to the outbox of every websocket client. Clients are the Starlette
+    websockets themselves: FastHTML builds a new `send` partial for every handler call, so those cannot be keys."""
+
+    def __init__(self, on_evict):
+        self.on_evict = on_evict
+        self.outboxes = {}
+        self._seq = itertools.count()
+
+    def attach(self, ws):
+        if ws not in self.outboxes:
+            self.outboxes[ws] = ClientOutbox(ws, self.on_evict)
+
+    def detach(self, ws):
+        outbox = self.outboxes.pop(ws, None)
+        if outbox:
+            outbox.close()
+
+    def queue_depth(self, ws) -> int:
+        outbox = self.outboxes.get(ws)
+        return len(outbox.pending) if outbox else 0
+
+    def send(self, element, clients, coalesce: bool = True):
+        """Queue `element` for every client in `clients` and return the clients whose outbox overflowed.
+        Fragments sent with `coalesce=False` (e.g. out-of-band appends) are always delivered in order."""
+        clients = list(clients)
+        if not clients:
+            return []
+        html = render(element)
+        key = element_id(element)
+        if key is None or not coalesce:
+            key = (key, next(self._seq))
+        failed = []
+        for client in clients:
+            outbox = self.outboxes.get(client)
+            if outbox and not outbox.put(key, html):
+                failed.append(client)
+        return failed
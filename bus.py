@@ -0,0 +1,168 @@
+import asyncio
+import fcntl
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import time
+import env_vars
+
+
+class LocalBus:
+    """In-process game-state bus, used when a single worker serves the whole game.
+
+    Events published on a channel are handed straight to its subscribers and commands are plain calls to the
+    handlers registered with `serve`."""
+    shared = False
+
+    def __init__(self):
+        self.worker_id = str(os.getpid())
+        self.handlers = {}
+        self.commands = {}
+
+    def subscribe(self, channel, handler):
+        self.handlers.setdefault(channel, []).append(handler)
+
+    async def publish(self, channel, message):
+        for handler in self.handlers.get(channel, ()):
+            try:
+                await handler(message)
+            except Exception:
+                logging.exception(f"Handler for bus channel {channel} failed")
+
+    def serve(self, commands):
+        self.commands = commands
+
+    async def call(self, command, payload, timeout: float = env_vars.BUS_CALL_TIMEOUT_SEC):
+        if command not in self.commands:
+            raise LookupError(f"No game server is handling {command!r}")
+        return await self.commands[command](payload)
+
+    async def cast(self, command, payload):
+        if command in self.commands:
+            await self.commands[command](payload)
+
+    async def run(self):
+        pass
+
+
+class SqliteBus(LocalBus):
+    """Game-state bus shared by several worker processes through a SQLite file.
+
+    Every message is a row in the `bus` table; each worker polls for rows newer than the last one it has seen.
+    Commands go to the `commands` channel and their replies to `reply:<worker id>`. Old rows are trimmed by the
+    worker serving the commands."""
+    shared = True
+
+    def __init__(self, path: str = env_vars.BUS_DB_PATH, poll_interval: float = env_vars.BUS_POLL_MS / 1000, retention: float = 30):
+        super().__init__()
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS bus (id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT NOT NULL, payload TEXT NOT NULL, created REAL NOT NULL)")
+        self.last_id = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM bus").fetchone()[0]
+        self.calls = {}
+        self._call_ids = itertools.count()
+        self.subscribe(f"reply:{self.worker_id}", self._on_reply)
+
+    async def publish(self, channel, message):
+        # like LocalBus, publishing never raises into game code: a lost event is logged, not fatal
+        try:
+            self._insert(channel, message)
+        except sqlite3.Error:
+            logging.exception(f"Could not publish on bus channel {channel}")
+
+    def _insert(self, channel, message):
+        self.conn.execute("INSERT INTO bus (channel, payload, created) VALUES (?, ?, ?)", (channel, json.dumps(message), time.time()))
+
+    def serve(self, commands):
+        super().serve(commands)
+        self.subscribe('commands', self._on_command)
+
+    async def call(self, command, payload, timeout: float = env_vars.BUS_CALL_TIMEOUT_SEC):
+        if self.commands:
+            return await super().call(command, payload)
+        call_id = f"{self.worker_id}:{next(self._call_ids)}"
+        future = asyncio.get_running_loop().create_future()
+        self.calls[call_id] = future
+        try:
+            # a caller waits for the reply, so it should hear at once that the command never went out
+            self._insert('commands', {'command': command, 'payload': payload, 'reply_to': self.worker_id, 'call_id': call_id})
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.calls.pop(call_id, None)
+
+    async def cast(self, command, payload):
+        if self.commands:
+            return await super().cast(command, payload)
+        await self.publish('commands', {'command': command, 'payload': payload})
+
+    async def _on_reply(self, message):
+        future = self.calls.get(message['call_id'])
+        if future and not future.done():
+            if 'error' in message:
+                future.set_exception(RuntimeError(message['error']))
+            else:
+                future.set_result(message['result'])
+
+    async def _on_command(self, message):
+        # commands may wait on the game state, so they must not hold up the poll loop
+        asyncio.create_task(self._run_command(message))
+
+    async def _run_command(self, message):
+        reply = {'call_id': message.get('call_id')}
+        try:
+            reply['result'] = await self.commands[message['command']](message['payload'])
+        except Exception as e:
+            logging.exception(f"Command {message['command']} failed")
+            reply['error'] = str(e)
+        if message.get('reply_to'):
+            await self.publish(f"reply:{message['reply_to']}", reply)
+
+    async def run(self):
+        last_trim = time.monotonic()
+        while True:
+            # a locked or busy database must not end the poll task, or this worker stops hearing the bus
+            try:
+                rows = self.conn.execute("SELECT id, channel, payload FROM bus WHERE id > ? ORDER BY id", (self.last_id,)).fetchall()
+                for row_id, channel, payload in rows:
+                    self.last_id = row_id
+                    if channel in self.handlers:
+                        await LocalBus.publish(self, channel, json.loads(payload))
+                if self.commands and time.monotonic() - last_trim > self.retention:
+                    last_trim = time.monotonic()
+                    self.conn.execute("DELETE FROM bus WHERE created < ?", (time.time() - self.retention,))
+            except Exception:
+                logging.exception("Polling the bus failed")
+            await asyncio.sleep(self.poll_interval)
+
+
+def create_bus(kind: str = env_vars.GAME_BUS):
+    if kind == 'sqlite':
+        return SqliteBus()
+    if kind == 'local':
+        return LocalBus()
+    raise ValueError(f"Unknown GAME_BUS {kind!r}, expected 'local' or 'sqlite'")
+
+
+class LeaderLock:
+    "Non-blocking exclusive file lock; the worker holding it owns the round clocks and the game state"
+
+    def __init__(self, path: str = env_vars.LEADER_LOCK_PATH):
+        self.path = path
+        self.file = None
+
+    def acquire(self) -> bool:
+        if self.file:
+            return True
+        file = open(self.path, 'a')
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            file.close()
+            return False
+        self.file = file
+        return True
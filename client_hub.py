@@ -0,0 +1,75 @@
+import itertools
+import logging
+from broadcast import Broadcaster, Fragment, close_client
+from presence import Presence
+import metrics
+
+
+class ClientHub:
+    """Websockets connected to this worker, grouped by room and user.
+
+    The game server never sees the sockets themselves: it publishes rendered fragments for a room (or for some
+    users of a room) on the bus, and every worker hands them to the outbound queues of its own clients."""
+
+    def __init__(self, bus):
+        self.bus = bus
+        # room id -> Presence of this worker's websockets in that room; connections: websocket -> (room id, user key, conn id)
+        self.online_users = {}
+        self.connections = {}
+        self.broadcaster = Broadcaster(on_evict=self.evict)
+        self._conn_ids = itertools.count()
+
+    def add(self, room_id, client_key, ws):
+        "Register the websocket `ws` and return the connection id the game server knows it by"
+        conn_id = f"{self.bus.worker_id}:{next(self._conn_ids)}"
+        if room_id not in self.online_users:
+            self.online_users[room_id] = Presence()
+        self.online_users[room_id].add(client_key, ws)
+        self.connections[ws] = (room_id, client_key, conn_id)
+        self.broadcaster.attach(ws)
+        return conn_id
+
+    def remove(self, ws):
+        info = self.connections.pop(ws, None)
+        if info:
+            room = self.online_users[info[0]]
+            room.remove(ws)
+            if not room:
+                del self.online_users[info[0]]
+        self.broadcaster.detach(ws)
+        return info
+
+    async def disconnect(self, ws):
+        info = self.remove(ws)
+        if info:
+            room_id, _, conn_id = info
+            await self.bus.cast('disconnect', {'room': room_id, 'conn': conn_id})
+
+    async def evict(self, ws, code: int = 1000):
+        logging.debug("Evicting client: %s", ws)
+        await self.disconnect(ws)
+        await close_client(ws, code)
+
+    async def close_all(self):
+        # 1012 (service restart) makes htmx reconnect
+        for ws in list(self.connections):
+            await self.evict(ws, 1012)
+
+    async def send(self, ws, fragments):
+        "Queue `fragments` (`[key, html]` pairs) for a single client"
+        for key, html in fragments:
+            for client in self.broadcaster.send(Fragment(key, html), [ws]):
+                await self.evict(client)
+
+    async def deliver(self, message):
+        "Bus handler for `fanout`: queue a fragment for the clients of a room on this worker"
+        room = self.online_users.get(message['room'])
+        if room is None:
+            return
+        clients = room.sockets(message.get('users'))
+        start = metrics.start_timer()
+        failed = self.broadcaster.send(Fragment(message['key'], message['html']), clients, message.get('coalesce', True))
+        metrics.FANOUT_SECONDS.observe_since(start)
+        for client in failed:
+            metrics.FANOUT_EVICTIONS.inc()
+            await self.evict(client)
@@ -32,9 +32,115 @@ COMBO_WIN_POINTS = int(os.environ.get("COMBO_WIN_POINTS", 50))
 HF_CLIENT_ID = os.environ.get("HF_CLIENT_ID")
 HF_CLIENT_SECRET = os.environ.get("HF_CLIENT_SECRET")
 HF_REDIRECT_URI = os.environ.get("HF_REDIRECT_URI")
+HF_TOKEN_URL = os.environ.get("HF_TOKEN_URL", "https://huggingface.co/oauth/token")
+HF_INFO_URL = os.environ.get("HF_INFO_URL", "https://huggingface.co/oauth/userinfo")
 
 GOOGLE_CLIENT_ID = os.environ.get("GOOGLE_CLIENT_ID")
 GOOGLE_CLIENT_SECRET = os.environ.get("GOOGLE_CLIENT_SECRET")
 GOOGLE_REDIRECT_URI = os.environ.get("GOOGLE_REDIRECT_URI")
+GOOGLE_TOKEN_URL = os.environ.get("GOOGLE_TOKEN_URL", "https://www.googleapis.com/oauth2/v4/token")
+GOOGLE_INFO_URL = os.environ.get("GOOGLE_INFO_URL", "https://www.googleapis.com/oauth2/v3/userinfo")
 
 DB_DIRECTORY = os.environ.get("DB_DIRECTORY", "")
+
+# HOW LONG (IN SECONDS) A SINGLE WEBSOCKET SEND MAY TAKE BEFORE THE CLIENT IS EVICTED
+WS_SEND_TIMEOUT_SEC = float(os.environ.get("WS_SEND_TIMEOUT_SEC", 2))
+
+# MAXIMUM NUMBER OF DISTINCT FRAGMENTS WAITING IN ONE WEBSOCKET'S OUTBOUND QUEUE BEFORE THE CLIENT IS EVICTED
+WS_OUTBOX_MAX_FRAGMENTS = int(os.environ.get("WS_OUTBOX_MAX_FRAGMENTS", 32))
+
+# HOW MANY OF THE MOST RECENT GUESSES ARE KEPT IN THE GUESSES FEED
+GUESSES_FEED_SIZE = int(os.environ.get("GUESSES_FEED_SIZE", 200))
+
+# NUMBER OF PLAYERS SHOWN ON THE LEADERBOARD
+LEADERBOARD_SIZE = int(os.environ.get("LEADERBOARD_SIZE", 20))
+
+# HOW OFTEN (IN SECONDS) PENDING POINTS CHANGES ARE WRITTEN TO THE DATABASE. THIS IS ALSO HOW MUCH CAN BE LOST ON A CRASH.
+# 0 WRITES EVERY CHANGE IMMEDIATELY.
+POINTS_FLUSH_SEC = float(os.environ.get("POINTS_FLUSH_SEC", 2))
+
+# SQLITE SYNCHRONOUS MODE (OFF, NORMAL OR FULL). NORMAL IS SAFE WITH WAL AGAINST APPLICATION CRASHES, FULL ALSO AGAINST POWER LOSS.
+SQLITE_SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+
+# A WORD CANNOT COME BACK UNTIL AT LEAST THIS MANY OTHER WORDS HAVE BEEN PLAYED
+WORD_NO_REPEAT_WINDOW = int(os.environ.get("WORD_NO_REPEAT_WINDOW", 50))
+
+# A WRONG GUESS AT LEAST THIS SIMILAR TO THE WORD GETS A "YOU'RE CLOSE!" MESSAGE
+CLOSE_GUESS_THRESHOLD = float(os.environ.get("CLOSE_GUESS_THRESHOLD", 0.75))
+
+# HOW MANY GUESSES PER SECOND ONE SESSION MAY SEND ON AVERAGE, AND HOW MANY IN A BURST. 0 DISABLES THE LIMIT.
+GUESS_RATE_PER_SEC = float(os.environ.get("GUESS_RATE_PER_SEC", 2))
+GUESS_BURST = int(os.environ.get("GUESS_BURST", 5))
+
+# HOW MANY LETTER PURCHASES PER SECOND ONE SESSION MAY SEND ON AVERAGE, AND HOW MANY IN A BURST. 0 DISABLES THE LIMIT.
+BUY_RATE_PER_SEC = float(os.environ.get("BUY_RATE_PER_SEC", 1))
+BUY_BURST = int(os.environ.get("BUY_BURST", 3))
+
+# HOW MANY GUESS FEED UPDATES PER SECOND ARE PUSHED TO ALL CLIENTS. ABOVE THIS THE FEED IS RESENT ONCE PER TICK INSTEAD.
+FEED_BROADCAST_RATE_PER_SEC = float(os.environ.get("FEED_BROADCAST_RATE_PER_SEC", 20))
+FEED_BROADCAST_BURST = int(os.environ.get("FEED_BROADCAST_BURST", 40))
+
+# HOW MANY PLAYERS ARE PLACED IN A ROOM AUTOMATICALLY BEFORE A NEW ROOM IS OPENED. JOINING A ROOM BY URL IGNORES THIS.
+ROOM_CAPACITY = int(os.environ.get("ROOM_CAPACITY", 100))
+
+# MAXIMUM NUMBER OF ROOMS RUNNING AT THE SAME TIME
+MAX_ROOMS = int(os.environ.get("MAX_ROOMS", 50))
+
+# NUMBER OF SECONDS A ROOM WITHOUT CONNECTED CLIENTS KEEPS RUNNING BEFORE IT IS CLOSED
+ROOM_IDLE_SEC = float(os.environ.get("ROOM_IDLE_SEC", 300))
+
+# HOW WORKER PROCESSES SHARE THE GAME STATE: "local" FOR A SINGLE WORKER, "sqlite" TO RUN SEVERAL (uvicorn --workers N)
+GAME_BUS = os.environ.get("GAME_BUS", "local")
+
+# FILES USED BY THE "sqlite" BUS AND TO ELECT THE WORKER THAT RUNS THE ROUNDS
+BUS_DB_PATH = os.environ.get("BUS_DB_PATH", f"{DB_DIRECTORY}bus.db")
+LEADER_LOCK_PATH = os.environ.get("LEADER_LOCK_PATH", f"{DB_DIRECTORY}game.lock")
+
+# HOW OFTEN (IN MILLISECONDS) A WORKER CHECKS THE "sqlite" BUS FOR NEW MESSAGES
+BUS_POLL_MS = int(os.environ.get("BUS_POLL_MS", 20))
+
+# HOW LONG (IN SECONDS) A WORKER WAITS FOR THE GAME SERVER TO ANSWER A REQUEST
+BUS_CALL_TIMEOUT_SEC = float(os.environ.get("BUS_CALL_TIMEOUT_SEC", 3))
+
+# NUMBER OF UVICORN WORKER PROCESSES STARTED BY `python app.py`. MORE THAN 1 NEEDS GAME_BUS=sqlite.
+WEB_WORKERS = int(os.environ.get("WEB_WORKERS", 1))
+
+# A ROUND TICK THAT RUNS MORE THAN THIS MANY SECONDS AFTER ITS DEADLINE IS LOGGED AS LATE (THE EVENT LOOP IS OVERLOADED)
+TICK_LATE_WARN_SEC = float(os.environ.get("TICK_LATE_WARN_SEC", 0.25))
+
+# WHERE THE WORDS TABLE IS IMPORTED FROM ON FIRST START: A LOCAL .parquet, .jsonl OR .csv FILE, OR A HUGGING FACE DATASET NAME
+WORDS_SOURCE = os.environ.get("WORDS_SOURCE", "Mihaiii/guess_the_word-3")
+
+# HOW MANY WORDS ARE INSERTED PER executemany CALL DURING THE IMPORT
+WORDS_IMPORT_CHUNK = int(os.environ.get("WORDS_IMPORT_CHUNK", 5000))
+
+# HOW MANY RECENTLY ACTIVE PLAYERS ARE KEPT IN MEMORY. OLDER ONES ARE RELOADED FROM THE DATABASE WHEN THEY COME BACK.
+PLAYER_CACHE_SIZE = int(os.environ.get("PLAYER_CACHE_SIZE", 10000))
+
+# HOW LONG (IN SECONDS) A REQUEST TO AN OAUTH PROVIDER MAY TAKE, AND HOW MANY LOGINS TALK TO THE PROVIDERS AT THE SAME TIME
+OAUTH_TIMEOUT_SEC = float(os.environ.get("OAUTH_TIMEOUT_SEC", 10))
+OAUTH_MAX_CONCURRENCY = int(os.environ.get("OAUTH_MAX_CONCURRENCY", 20))
+
+# "client": THE SERVER SENDS THE TIME LEFT IN THE ROUND WHEN IT STARTS, ON CONNECT AND EVERY COUNTDOWN_RESYNC_SEC SECONDS, AND
+# THE BROWSER TICKS THE COUNTDOWN ITSELF. "server": THE SERVER SENDS THE COUNTDOWN EVERY SECOND.
+COUNTDOWN_MODE = os.environ.get("COUNTDOWN_MODE", "client")
+COUNTDOWN_RESYNC_SEC = max(int(os.environ.get("COUNTDOWN_RESYNC_SEC", 10)), 1)
+
+# SHARE OF HOT-PATH CALLS (GUESSES, FAN-OUTS, QUERIES) THAT ARE TIMED FOR /metrics. 0 TURNS INSTRUMENTATION OFF.
+METRICS_SAMPLE_RATE = float(os.environ.get("METRICS_SAMPLE_RATE", 1))
+
+# NEGOTIATE permessage-deflate COMPRESSION ON WEBSOCKETS (WHEN STARTED WITH `python app.py`; WITH THE uvicorn CLI USE --ws-per-message-deflate)
+WS_PER_MESSAGE_DEFLATE = os.environ.get("WS_PER_MESSAGE_DEFLATE", "1").lower() not in ("0", "false", "no", "off")
+
+# WHERE THE LOG OF ROUND EVENTS (ROUND STARTS, GUESSES, WINS, PURCHASES) IS WRITTEN. A RESTART RESUMES THE RUNNING ROUNDS FROM IT.
+EVENT_LOG_DIR = os.environ.get("EVENT_LOG_DIR", f"{DB_DIRECTORY}events")
+
+# HOW OFTEN (IN MILLISECONDS) BUFFERED EVENTS ARE WRITTEN AND FSYNCED TOGETHER. THIS IS ALSO HOW MUCH CAN BE LOST ON A CRASH.
+EVENT_LOG_COMMIT_MS = float(os.environ.get("EVENT_LOG_COMMIT_MS", 50))
+
+# A NEW LOG SEGMENT IS STARTED AFTER THIS MANY BYTES OR SECONDS. EVERY EVENT_LOG_COMPACT_SEC, OLD SEGMENTS ARE MOVED INTO guess.db.
+EVENT_LOG_SEGMENT_BYTES = int(os.environ.get("EVENT_LOG_SEGMENT_BYTES", 4 * 1024 * 1024))
+EVENT_LOG_COMPACT_SEC = float(os.environ.get("EVENT_LOG_COMPACT_SEC", 60))
+
+# GUESSES ARRIVING WITHIN THIS MANY MILLISECONDS OF EACH OTHER ARE PUSHED TO THE CLIENTS AS ONE FEED AND LEADERBOARD UPDATE
+GUESS_BATCH_MS = float(os.environ.get("GUESS_BATCH_MS", 100))
@@ -0,0 +1,179 @@
+import asyncio
+import glob
+import json
+import logging
+import os
+import sqlite3
+import time
+import env_vars
+
+
+class EventLog:
+    """Append-only log of game events, as JSON lines in numbered segment files.
+
+    `append` only buffers the event; a writer task writes everything buffered every `commit_ms` and fsyncs it
+    once for the whole group (off the event loop), so the cost of an fsync is shared by all the events of that
+    window. The active segment is rotated when it grows past `segment_bytes` or gets older than `rotate_sec`.
+    Closed segments are folded into a database table by `compact` and then deleted."""
+
+    def __init__(self, directory: str = env_vars.EVENT_LOG_DIR, commit_ms: float = env_vars.EVENT_LOG_COMMIT_MS,
+                 segment_bytes: int = env_vars.EVENT_LOG_SEGMENT_BYTES, rotate_sec: float = env_vars.EVENT_LOG_COMPACT_SEC):
+        self.directory = directory
+        self.commit_interval = commit_ms / 1000
+        self.segment_bytes = segment_bytes
+        self.rotate_sec = rotate_sec
+        self.buffer = []
+        self.waiters = []
+        self.has_events = asyncio.Event()
+        self.file = None
+        self.opened_at = 0
+        self.lock = asyncio.Lock()
+
+    def segments(self):
+        return sorted(glob.glob(os.path.join(self.directory, 'events-*.jsonl')))
+
+    def read(self, segments=None):
+        "Every event in `segments` (by default all of them), oldest first. A torn last line is skipped."
+        for path in self.segments() if segments is None else segments:
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        logging.warning(f"Skipping a torn event in {path}")
+
+    def append(self, event):
+        event['ts'] = time.time()
+        self.buffer.append(json.dumps(event, separators=(',', ':')) + '\n')
+        self.has_events.set()
+
+    async def sync(self):
+        "Wait until every event appended so far is on disk"
+        if self.buffer:
+            future = asyncio.get_running_loop().create_future()
+            self.waiters.append(future)
+            await future
+
+    async def commit(self):
+        async with self.lock:
+            lines, self.buffer = self.buffer, []
+            waiters, self.waiters = self.waiters, []
+            self.has_events.clear()
+            if lines:
+                try:
+                    await asyncio.to_thread(self._write, lines)
+                except Exception as e:
+                    for waiter in waiters:
+                        waiter.set_exception(e)
+                    raise
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+
+    def _write(self, lines):
+        if self.file is None or self.file.tell() >= self.segment_bytes or time.monotonic() - self.opened_at >= self.rotate_sec:
+            self._rotate()
+        self.file.write(''.join(lines))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def _rotate(self):
+        if self.file:
+            self.file.close()
+        os.makedirs(self.directory, exist_ok=True)
+        segments = self.segments()
+        number = int(os.path.basename(segments[-1])[7:-6]) + 1 if segments else 1
+        self.file = open(os.path.join(self.directory, f'events-{number:08d}.jsonl'), 'a', encoding='utf-8')
+        self.opened_at = time.monotonic()
+
+    def active_segment(self):
+        return self.file.name if self.file else None
+
+    def compact(self, db_path: str, keep_sec: float):
+        """Copy the events of closed segments whose last event is older than `keep_sec` into the round_events
+        table of the database at `db_path` in one transaction, then delete those segments. Newer segments are kept
+        for `replay`. If the copy fails nothing is inserted and the segments stay for the next compaction."""
+        cutoff = time.time() - keep_sec
+        done = []
+        rows = []
+        for path in self.segments():
+            if path == self.active_segment():
+                continue
+            events = list(self.read([path]))
+            if events and events[-1]['ts'] > cutoff:
+                break
+            rows.extend((event['ts'], event.get('t'), event.get('room'), json.dumps(event)) for event in events)
+            done.append(path)
+        if not done:
+            return 0
+        # runs in a worker thread: its own connection, in autocommit mode with an explicit BEGIN so it is all or nothing
+        conn = sqlite3.connect(db_path, isolation_level=None)
+        try:
+            conn.execute('BEGIN')
+            try:
+                conn.execute("CREATE TABLE IF NOT EXISTS round_events (ts REAL NOT NULL, type TEXT, room TEXT, event TEXT NOT NULL)")
+                conn.executemany("INSERT INTO round_events (ts, type, room, event) VALUES (?, ?, ?, ?)", rows)
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        finally:
+            conn.close()
+        for path in done:
+            os.remove(path)
+        logging.info(f"Compacted {len(done)} event log segments ({len(rows)} events)")
+        return len(rows)
+
+    async def run(self, db_path: str, keep_sec: float):
+        last_compaction = time.monotonic()
+        while True:
+            await self.has_events.wait()
+            await asyncio.sleep(self.commit_interval)
+            try:
+                await self.commit()
+            except Exception:
+                logging.exception("Could not write the event log")
+            if time.monotonic() - last_compaction >= self.rotate_sec:
+                last_compaction = time.monotonic()
+                # not while a commit may be rotating segments
+                async with self.lock:
+                    try:
+                        await asyncio.to_thread(self.compact, db_path, keep_sec)
+                    except Exception:
+                        logging.exception("Could not compact the event log")
+
+    async def close(self):
+        await self.commit()
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+def replay(events, round_sec: float, now: float = None):
+    """Fold the game events into what a restart needs.
+
+    Returns the latest balance of every player that won or bought something, and for each room whose last round
+    was still running at `now` the state to resume it with: word id, random letters, start time, guess feed,
+    winners and the letters each user bought."""
+    now = time.time() if now is None else now
+    points = {}
+    rounds = {}
+    for event in events:
+        kind = event.get('t')
+        if kind in ('win', 'buy'):
+            points[event['player_id']] = event['points']
+        if kind == 'round':
+            rounds[event['room']] = {'word_id': event['word_id'], 'random_letters': event['random_letters'], 'started': event['ts'],
+                                     'guesses': [], 'winners': [], 'letters': {}}
+            continue
+        current = rounds.get(event.get('room'))
+        if current is None:
+            continue
+        if kind == 'guess':
+            current['guesses'].append(event['entry'])
+        elif kind == 'win':
+            current['winners'].append(event['name'])
+        elif kind == 'buy':
+            current['letters'][event['user']] = current['letters'].get(event['user'], 0) | 1 << event['letter']
+    running = {room_id: state for room_id, state in rounds.items() if now - state['started'] < round_sec}
+    return points, running
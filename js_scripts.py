@@ -108,4 +108,39 @@ def enterToGuess():
             }
         });
         """
-    return Script(src)
\ No newline at end of file
+    return Script(src)
+
+def countdownTicker():
+    "Ticks the round countdown locally from the time left the server put on #countdown (data-remaining-ms)"
+    src = """
+        (function() {
+            let counted = null;
+            let deadline = 0;
+            setInterval(function() {
+                const el = document.getElementById('countdown');
+                if (!el || el.dataset.remainingMs === undefined) return;
+                if (el !== counted) {
+                    // a fresh #countdown was swapped in: the round started or the server resynced us
+                    counted = el;
+                    deadline = performance.now() + Number(el.dataset.remainingMs);
+                }
+                const left = Math.max(0, Math.ceil((deadline - performance.now()) / 1000));
+                const text = left >= 10 ? String(left) : '0' + left;
+                if (el.textContent !== text) el.textContent = text;
+                el.classList.toggle('urgent', left <= Number(el.dataset.urgentAt));
+            }, 200);
+        })();
+        """
+    return Script(src)
+
+def trimGuessFeed(limit):
+    "Removes the guess rows past the newest `limit` after every websocket message, so the feed stays bounded in the browser too"
+    src = """
+        document.addEventListener('htmx:wsAfterMessage', function() {
+            const feed = document.getElementById('guesses');
+            if (!feed) return;
+            // rows are newest first; out-of-band appends only ever add at the front
+            while (feed.children.length > %d) feed.lastElementChild.remove();
+        });
+        """ % limit
+    return Script(src)
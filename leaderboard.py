@@ -0,0 +1,50 @@
+import env_vars
+
+
+class Leaderboard:
+    """In-memory top-K of players by points, updated on every points change.
+
+    Only the best `2 * size` players are tracked. `floor` is an upper bound on the points of every
+    player that is not tracked, so tracked players at or above it are ranked exactly; when fewer than
+    `size` of them are left the board is re-seeded through `load`."""
+
+    def __init__(self, load, size: int = env_vars.LEADERBOARD_SIZE):
+        self.load = load
+        self.size = size
+        self.capacity = size * 2
+        self.entries = {}
+        self.floor = float('-inf')
+        self.dirty = True
+        self.last_top = []
+        self.version = 0
+
+    def seed(self):
+        rows = self.load(self.capacity + 1)
+        self.entries = {row['id']: (row['name'], row['points']) for row in rows[:self.capacity]}
+        self.floor = rows[self.capacity]['points'] if len(rows) > self.capacity else float('-inf')
+
+    def update(self, player_id, name, points):
+        if player_id in self.entries or points >= self.floor:
+            self.entries[player_id] = (name, points)
+            self.dirty = True
+        if len(self.entries) > self.capacity:
+            lowest = min(self.entries, key=lambda k: self.entries[k][1])
+            self.floor = max(self.floor, self.entries.pop(lowest)[1])
+
+    def top(self):
+        ranked = sorted(self.entries.values(), key=lambda entry: entry[1], reverse=True)
+        exact = sum(1 for _, points in ranked if points >= self.floor)
+        if exact < self.size and self.floor != float('-inf'):
+            self.seed()
+            ranked = sorted(self.entries.values(), key=lambda entry: entry[1], reverse=True)
+        return ranked[:self.size]
+
+    def snapshot(self):
+        "`(version, top)`, where `version` only moves when the top `size` players actually changed"
+        if self.dirty:
+            self.dirty = False
+            top = self.top()
+            if top != self.last_top:
+                self.last_top = top
+                self.version += 1
+        return self.version, self.last_top
@@ -0,0 +1,61 @@
+import asyncio
+import logging
+import env_vars
+import metrics
+
+
+class PointsLedger:
+    """Write-behind buffer of player balances.
+
+    Points changes are kept in memory and written to the players table in a single transaction every
+    `interval` seconds (and on shutdown). Reads go through `points`/`apply` so they see pending balances."""
+
+    def __init__(self, db, table, interval: float = env_vars.POINTS_FLUSH_SEC):
+        self.db = db
+        self.table = table
+        self.interval = interval
+        self.pending = {}
+
+    def set(self, player_id, points):
+        self.pending[player_id] = points
+        if self.interval <= 0:
+            self.flush()
+
+    def points(self, player_id, default=None):
+        return self.pending.get(player_id, default)
+
+    def apply(self, row):
+        "`row` from the players table with its pending balance applied"
+        if row['id'] in self.pending:
+            row = {**row, 'points': self.pending[row['id']]}
+        return row
+
+    def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, {}
+        start = metrics.start_timer()
+        conn = self.db.conn
+        try:
+            # fastlite's connection is in autocommit mode, where `with conn:` would commit every update on its own
+            conn.execute('BEGIN')
+            try:
+                conn.executemany(f"update {self.table} set points = ? where id = ?", [(points, player_id) for player_id, points in batch.items()])
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        except Exception:
+            # keep the balances for the next flush, unless a newer value arrived in the meantime
+            self.pending = {**batch, **self.pending}
+            raise
+        metrics.SQLITE_QUERY_SECONDS.observe_since(start, "ledger flush (executemany update points)")
+        logging.debug("Flushed %d player balances", len(batch))
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(max(self.interval, 0.1))
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Could not flush player balances: {e}")
@@ -0,0 +1,51 @@
+import env_vars
+
+
+class NearMissMatcher:
+    """Tells whether a wrong guess is close to the word of the current round.
+
+    Closeness is `2 * LCS / (len(word) + len(guess))`, computed exactly with a bit-parallel LCS over the word's
+    character masks. This is deliberately not `difflib.SequenceMatcher.ratio()`: difflib counts greedy matching
+    blocks, which can be fewer than the LCS, so this test is more lenient and calls some guesses close that
+    difflib would not (e.g. "usptxst" for "upstst": difflib 0.615, LCS 0.769). The masks are built once per
+    round, a guess is rejected as soon as the threshold can no longer be reached, and verdicts are cached for
+    the rest of the round."""
+
+    def __init__(self, word: str, threshold: float = env_vars.CLOSE_GUESS_THRESHOLD, cache_size: int = 4096):
+        self.word = word.lower()
+        self.threshold = threshold
+        self.cache_size = cache_size
+        self.cache = {}
+        self.mask = (1 << len(self.word)) - 1
+        self.char_masks = {}
+        for i, ch in enumerate(self.word):
+            self.char_masks[ch] = self.char_masks.get(ch, 0) | (1 << i)
+
+    def is_close(self, guess: str) -> bool:
+        guess = guess.lower()
+        verdict = self.cache.get(guess)
+        if verdict is None:
+            verdict = self._is_close(guess)
+            if len(self.cache) >= self.cache_size:
+                self.cache.clear()
+            self.cache[guess] = verdict
+        return verdict
+
+    def _is_close(self, guess: str) -> bool:
+        total = len(self.word) + len(guess)
+        if total == 0:
+            return True
+        # smallest LCS that still reaches the threshold
+        needed = self.threshold * total / 2
+        if min(len(self.word), len(guess)) < needed:
+            return False
+        mask, char_masks = self.mask, self.char_masks
+        v = mask
+        remaining = len(guess)
+        for ch in guess:
+            u = v & char_masks.get(ch, 0)
+            v = ((v + u) | (v - u)) & mask
+            remaining -= 1
+            if (~v & mask).bit_count() + remaining < needed:
+                return False
+        return True
@@ -0,0 +1,127 @@
+"""Process-local counters, histograms and gauges, rendered in the Prometheus text format by `render()`.
+
+Timings on hot paths are sampled: `start_timer()` returns None for calls that are not sampled (all of them when
+METRICS_SAMPLE_RATE is 0) and `observe_since(None)` does nothing, so an unsampled call costs one comparison.
+Counters are only incremented while metrics are enabled."""
+from bisect import bisect_left
+import random
+import time
+import env_vars
+
+sample_rate = env_vars.METRICS_SAMPLE_RATE
+enabled = sample_rate > 0
+registry = []
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+
+def start_timer():
+    "perf_counter() for a sampled call, None otherwise"
+    if sample_rate >= 1 or (sample_rate > 0 and random.random() < sample_rate):
+        return time.perf_counter()
+    return None
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.values = {}
+        registry.append(self)
+
+    def inc(self, *label_values, value: float = 1):
+        if enabled:
+            self.values[label_values] = self.values.get(label_values, 0) + value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for label_values, value in self.values.items():
+            yield f"{self.name}{_labels(self.labels, label_values)} {value}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}
+        registry.append(self)
+
+    def observe(self, value: float, *label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            # per-bucket counts (not cumulative) plus +Inf, then sum
+            series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def observe_since(self, start, *label_values):
+        if start is not None:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for label_values, (counts, total) in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_labels(self.labels + ('le',), label_values + (bound,))} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, label_values)} {total}"
+            yield f"{self.name}_count{_labels(self.labels, label_values)} {cumulative}"
+
+
+class Gauge:
+    "Read when /metrics is scraped: `collect()` returns {label values tuple: value}"
+
+    def __init__(self, name: str, help: str, collect, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.collect = collect
+        registry.append(self)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        for label_values, value in self.collect().items():
+            yield f"{self.name}{_labels(self.labels, label_values)} {value}"
+
+
+def timed_queries(db):
+    "Time every `db.q` call of a fastlite database, labelled by its (whitespace-normalised) statement"
+    query = db.q
+
+    def q(sql, params=None):
+        start = start_timer()
+        try:
+            return query(sql, params)
+        finally:
+            if start is not None:
+                SQLITE_QUERY_SECONDS.observe(time.perf_counter() - start, ' '.join(sql.split()))
+    db.q = q
+    return db
+
+
+def render() -> str:
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+FANOUT_SECONDS = Histogram("gtw_fanout_seconds", "Time to queue one fragment for the websockets of a room on this worker")
+FANOUT_EVICTIONS = Counter("gtw_fanout_evictions_total", "Websockets evicted because their outbound queue was full")
+WS_SEND_FAILURES = Counter("gtw_ws_send_failures_total", "Websocket sends that failed or timed out", labels=("reason",))
+TICK_LATENESS_SECONDS = Histogram("gtw_tick_lateness_seconds", "How late round ticks woke up after their deadline")
+TICKS_SKIPPED = Counter("gtw_ticks_skipped_total", "Round ticks skipped because the event loop was more than a tick late")
+GUESS_SECONDS = Histogram("gtw_guess_seconds", "Latency of POST /guess, including the round trip to the game server")
+GUESSES = Counter("gtw_guesses_total", "Guesses handled by POST /guess", labels=("result",))
+SQLITE_QUERY_SECONDS = Histogram("gtw_sqlite_query_seconds", "SQLite statement time", labels=("statement",))
@@ -0,0 +1,53 @@
+from collections import OrderedDict
+import env_vars
+
+
+class PlayerRecord:
+    __slots__ = ('id', 'name', 'points')
+
+    def __init__(self, id: int, name: str, points: int):
+        self.id = id
+        self.name = name
+        self.points = points
+
+
+class PlayerStore:
+    """Player records keyed by session id.
+
+    A record is loaded from the players table (through its index on name) the first time a session is seen
+    and then served from memory. Only the `max_records` most recently active sessions are kept; points that
+    are still waiting in the write-behind ledger survive an eviction because `get` applies them on reload.
+    Points changes go through `set_points`, which keeps the record and the ledger in step."""
+
+    def __init__(self, db, table, ledger, max_records: int = env_vars.PLAYER_CACHE_SIZE):
+        self.db = db
+        self.table = table
+        self.ledger = ledger
+        self.max_records = max_records
+        self.records = OrderedDict()
+
+    def get(self, session_id):
+        record = self.records.get(session_id)
+        if record is not None:
+            self.records.move_to_end(session_id)
+            return record
+        rows = self.db.q(f"select * from {self.table} where {self.table.c.name} = ? order by {self.table.c.id} limit 1", (session_id,))
+        if not rows:
+            return None
+        row = self.ledger.apply(rows[0])
+        return self._remember(session_id, PlayerRecord(row['id'], row['name'], row['points']))
+
+    def create(self, session_id, points):
+        with self.db.conn:
+            rows = self.db.q(f"INSERT INTO {self.table} (name, points) VALUES (?, ?) RETURNING id", (session_id, points))
+        return self._remember(session_id, PlayerRecord(rows[0]['id'], session_id, points))
+
+    def _remember(self, session_id, record):
+        self.records[session_id] = record
+        if len(self.records) > self.max_records:
+            self.records.popitem(last=False)
+        return record
+
+    def set_points(self, record, points):
+        record.points = points
+        self.ledger.set(record.id, points)
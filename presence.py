@@ -0,0 +1,73 @@
+ANONYMOUS = "unassigned_clients"
+
+
+class Presence:
+    """Users connected to a room: user key -> the user's state, with their sockets under 'ws_clients', plus the
+    reverse index socket -> user key, so connecting and disconnecting a socket are O(1).
+
+    A user is created with `new_user(key)` on their first socket and dropped with their last one. Sockets of
+    visitors that are not signed in all go under ANONYMOUS. Everything runs on the event loop and no method
+    awaits, so there is nothing to lock; code that awaits while walking the users iterates `snapshot()`, which
+    is only rebuilt after someone came or left."""
+
+    def __init__(self, new_user=None):
+        self.users = {}
+        self.owners = {}
+        self.new_user = new_user or (lambda key: {})
+        self._users_snapshot = None
+        self._sockets_snapshot = None
+
+    def __len__(self):
+        return len(self.users)
+
+    def __contains__(self, key):
+        return key in self.users
+
+    def __getitem__(self, key):
+        return self.users[key]
+
+    def get(self, key):
+        return self.users.get(key)
+
+    def player_count(self) -> int:
+        return len(self.users) - (ANONYMOUS in self.users)
+
+    def add(self, key, socket):
+        "Register `socket` for `key` and return the user's state"
+        user = self.users.get(key)
+        if user is None:
+            user = self.users[key] = {**self.new_user(key), 'ws_clients': set()}
+            self._users_snapshot = None
+        user['ws_clients'].add(socket)
+        self.owners[socket] = key
+        self._sockets_snapshot = None
+        return user
+
+    def remove(self, socket):
+        """Forget `socket`. Returns None for a socket we do not know, otherwise `(key, user)` where `user` is the
+        state of the user if that was their last socket (and they are gone now), else None"""
+        key = self.owners.pop(socket, None)
+        if key is None:
+            return None
+        self._sockets_snapshot = None
+        user = self.users[key]
+        user['ws_clients'].discard(socket)
+        if user['ws_clients']:
+            return key, None
+        del self.users[key]
+        self._users_snapshot = None
+        return key, user
+
+    def snapshot(self):
+        "`(key, user)` for every user, as a tuple that stays valid while users come and go"
+        if self._users_snapshot is None:
+            self._users_snapshot = tuple(self.users.items())
+        return self._users_snapshot
+
+    def sockets(self, keys=None):
+        "Sockets of the users in `keys`, or every socket"
+        if keys is None:
+            if self._sockets_snapshot is None:
+                self._sockets_snapshot = tuple(self.owners)
+            return self._sockets_snapshot
+        return [socket for key in keys if key in self.users for socket in self.users[key]['ws_clients']]
@@ -0,0 +1,80 @@
+import asyncio
+import itertools
+import logging
+import re
+import time
+import env_vars
+
+ROOM_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,32}$')
+
+
+class RoomManager:
+    """Game rooms by id, each one run by its own `TaskManager`.
+
+    Players are placed in the first room that has fewer than `capacity` players online, and a new room is
+    opened when every room is full. A room can also be joined by URL, which ignores the cap. Rooms nobody
+    has been connected to for `idle_sec` seconds are stopped, except the first one."""
+
+    def __init__(self, create_room, capacity: int = env_vars.ROOM_CAPACITY, max_rooms: int = env_vars.MAX_ROOMS, idle_sec: float = env_vars.ROOM_IDLE_SEC):
+        self.create_room = create_room
+        self.capacity = capacity
+        self.max_rooms = max_rooms
+        self.idle_sec = idle_sec
+        self.rooms = {}
+        self.idle_since = {}
+        self._ids = itertools.count(1)
+        self.default_room = self.open(str(next(self._ids)))
+
+    @staticmethod
+    def valid_id(room_id) -> bool:
+        return isinstance(room_id, str) and bool(ROOM_ID_PATTERN.match(room_id))
+
+    def get(self, room_id):
+        return self.rooms.get(room_id)
+
+    def open(self, room_id):
+        room = self.create_room(room_id)
+        self.rooms[room_id] = room
+        room.start()
+        logging.info(f"Opened room {room_id}")
+        return room
+
+    def occupancy(self, room) -> int:
+        return room.online_users.player_count()
+
+    def assign(self, requested=None, current=None):
+        "The room for a player asking for `requested` (by URL) whose session was last in `current`"
+        if self.valid_id(requested):
+            if requested in self.rooms:
+                return self.rooms[requested]
+            if len(self.rooms) < self.max_rooms:
+                return self.open(requested)
+        if current in self.rooms:
+            return self.rooms[current]
+        for room in self.rooms.values():
+            if self.occupancy(room) < self.capacity:
+                return room
+        if len(self.rooms) >= self.max_rooms:
+            return min(self.rooms.values(), key=self.occupancy)
+        room_id = str(next(self._ids))
+        while room_id in self.rooms:
+            room_id = str(next(self._ids))
+        return self.open(room_id)
+
+    def close_idle_rooms(self, now=None):
+        now = time.monotonic() if now is None else now
+        for room_id, room in list(self.rooms.items()):
+            if room is self.default_room or len(room.online_users):
+                self.idle_since.pop(room_id, None)
+                continue
+            since = self.idle_since.setdefault(room_id, now)
+            if now - since >= self.idle_sec:
+                room.stop()
+                del self.rooms[room_id]
+                del self.idle_since[room_id]
+                logging.info(f"Closed idle room {room_id}")
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(min(self.idle_sec, 30))
+            self.close_idle_rooms()
@@ -0,0 +1,66 @@
+import asyncio
+from collections import deque
+import logging
+import env_vars
+import metrics
+
+
+class TickClock:
+    """Ticks `interval` seconds apart, counted from a fixed start time on the event loop's monotonic clock.
+
+    Every tick sleeps until its own deadline, so slow tick work never pushes the following ticks back. A tick
+    that wakes up more than an interval late skips the ticks it missed. How late each tick woke up is kept
+    for the last `window` ticks; lateness is the best signal we have that the event loop is overloaded."""
+
+    def __init__(self, interval: float = 1.0, window: int = 600, warn_after: float = env_vars.TICK_LATE_WARN_SEC):
+        self.interval = interval
+        self.warn_after = warn_after
+        self.lateness = deque(maxlen=window)
+        self.late_ticks = 0
+        self.skipped_ticks = 0
+        self.origin = None
+        self.tick = -1
+
+    def start(self, origin: float, first_tick: int = 0):
+        "Make tick 0 fall on `origin` (a time of `loop.time()`); `next_tick` starts at `first_tick`"
+        self.origin = origin
+        self.tick = first_tick - 1
+
+    def deadline(self, tick: int) -> float:
+        return self.origin + tick * self.interval
+
+    async def next_tick(self) -> int:
+        "Sleep until the next tick is due and return its number"
+        loop = asyncio.get_running_loop()
+        tick = self.tick + 1
+        deadline = self.deadline(tick)
+        delay = deadline - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        lateness = loop.time() - deadline
+        self.lateness.append(lateness)
+        if metrics.enabled:
+            metrics.TICK_LATENESS_SECONDS.observe(max(lateness, 0.0))
+        if lateness > self.warn_after:
+            self.late_ticks += 1
+            logging.warning(f"Tick {tick} ran {lateness * 1000:.0f} ms late")
+        missed = int(lateness // self.interval)
+        if missed > 0:
+            self.skipped_ticks += missed
+            metrics.TICKS_SKIPPED.inc(value=missed)
+            tick += missed
+        self.tick = tick
+        return tick
+
+    def stats(self) -> dict:
+        ordered = sorted(self.lateness)
+        if not ordered:
+            return {'ticks': 0, 'late_ticks': self.late_ticks, 'skipped_ticks': self.skipped_ticks}
+        return {
+            'ticks': len(ordered),
+            'late_ticks': self.late_ticks,
+            'skipped_ticks': self.skipped_ticks,
+            'p50_ms': ordered[len(ordered) // 2] * 1000,
+            'p99_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000,
+            'max_ms': ordered[-1] * 1000,
+        }
@@ -0,0 +1,51 @@
+from collections import deque
+import random
+import env_vars
+
+
+class WordDeck:
+    """Shuffled deck of eligible word ids.
+
+    A draw pops one id and fetches its row by primary key, so picking a word does not depend on the
+    size of the table. The deck is reshuffled when it runs out, and the last `no_repeat` words drawn
+    are kept at the bottom of the new deck so they do not come back straight away."""
+
+    def __init__(self, db, table, min_length: int = 5, no_repeat: int = env_vars.WORD_NO_REPEAT_WINDOW):
+        self.db = db
+        self.table = table
+        self.min_length = min_length
+        self.recent = deque(maxlen=max(no_repeat, 0))
+        self.ids = []
+        self.deck = []
+
+    def build(self):
+        self.ids = [row['id'] for row in self.db.q(f"SELECT id FROM {self.table} WHERE LENGTH(word) > ?", (self.min_length,))]
+        self.shuffle()
+
+    def shuffle(self):
+        recent = set(self.recent)
+        eligible = set(self.ids)
+        fresh = [word_id for word_id in self.ids if word_id not in recent]
+        random.shuffle(fresh)
+        # draws pop from the end, so the recently used words go first in the list, newest first
+        self.deck = [word_id for word_id in reversed(self.recent) if word_id in eligible] + fresh
+
+    def get(self, word_id):
+        "The row of a word drawn earlier, or None if it is no longer in the table"
+        row = self.db.q(f"SELECT * FROM {self.table} WHERE id = ?", (word_id,))
+        return row[0] if row else None
+
+    def draw(self):
+        if not self.ids:
+            self.build()
+        while self.ids:
+            if not self.deck:
+                self.shuffle()
+            word_id = self.deck.pop()
+            row = self.db.q(f"SELECT * FROM {self.table} WHERE id = ?", (word_id,))
+            if row:
+                self.recent.append(word_id)
+                return row[0]
+            # the word was removed from the table after the deck was built
+            self.ids.remove(word_id)
+        raise LookupError(f"No words longer than {self.min_length} letters in {self.table}")
@@ -0,0 +1,86 @@
+import csv
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import time
+import env_vars
+
+WORD_COLUMNS = ('word', 'hint1', 'hint2', 'hint3', 'hint4', 'hint5')
+DATASET_COLUMNS = ('word', 'hint #1', 'hint #2', 'hint #3', 'hint #4', 'hint #5')
+
+WORDS_INDEXES = [
+    # WordDeck.build selects the ids of the words longer than its minimum length
+    "CREATE INDEX IF NOT EXISTS words_word_length ON words (LENGTH(word))",
+]
+
+
+def iter_records(source: str):
+    """Stream the records of `source`: a local .parquet, .jsonl or .csv file, or else the name of a Hugging Face
+    dataset. `datasets` (and `pyarrow` for Parquet) are only imported when they are needed."""
+    suffix = os.path.splitext(source)[1].lower()
+    if suffix in ('.jsonl', '.ndjson'):
+        with open(source, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    elif suffix == '.csv':
+        with open(source, encoding='utf-8', newline='') as f:
+            yield from csv.DictReader(f)
+    elif suffix == '.parquet':
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(source)
+        # read only the word columns, under whichever of the two namings the file uses (see `word_row`)
+        columns = DATASET_COLUMNS if DATASET_COLUMNS[1] in parquet_file.schema_arrow.names else WORD_COLUMNS
+        for batch in parquet_file.iter_batches(columns=list(columns)):
+            yield from batch.to_pylist()
+    else:
+        from datasets import load_dataset
+        yield from load_dataset(source, split='train', streaming=True)
+
+
+def word_row(record):
+    # the dataset names its columns "hint #1".., a file exported from the words table names them "hint1"..
+    return tuple(record[dataset] if dataset in record else record[column] for column, dataset in zip(WORD_COLUMNS, DATASET_COLUMNS))
+
+
+def chunked(iterable, size: int):
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+def import_words(db_path: str, source: str = env_vars.WORDS_SOURCE, chunk_size: int = env_vars.WORDS_IMPORT_CHUNK) -> int:
+    "Create the words table and fill it from `source` in chunks, all in one transaction. Returns the number of rows."
+    started = time.perf_counter()
+    # autocommit mode with an explicit BEGIN, so the CREATE TABLE is rolled back too if the source fails half way
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    count = 0
+    try:
+        conn.execute('BEGIN')
+        conn.execute('''
+            CREATE TABLE words (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                word TEXT NOT NULL,
+                hint1 TEXT NOT NULL,
+                hint2 TEXT NOT NULL,
+                hint3 TEXT NOT NULL,
+                hint4 TEXT NOT NULL,
+                hint5 TEXT NOT NULL
+            );
+        ''')
+        insert_query = f"INSERT INTO words ({', '.join(WORD_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)"
+        for chunk in chunked(map(word_row, iter_records(source)), chunk_size):
+            conn.executemany(insert_query, chunk)
+            count += len(chunk)
+        for statement in WORDS_INDEXES:
+            conn.execute(statement)
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+    logging.info(f"Imported {count} words from {source} in {time.perf_counter() - started:.1f}s")
+    return count